@@ -0,0 +1,138 @@
+from typing import List, Tuple
+
+
+def build_argmin_table(scores: List[float]) -> List[List[int]]:
+    # sparse table: table[k][i] - index of the minimal score in [i, i + 2^k), the leftmost one on ties
+    table = [list(range(len(scores)))]
+    width = 1
+
+    while 2 * width <= len(scores):
+        previous = table[-1]
+        table.append([left if scores[left] <= scores[right] else right
+                      for left, right in zip(previous, previous[width:])])
+        width *= 2
+    return table
+
+
+def range_argmin(table: List[List[int]], scores: List[float], start: int, end: int) -> int:
+    # index of the minimal score in [start, end) in O(1)
+    level = (end - start).bit_length() - 1
+    left, right = table[level][start], table[level][end - (1 << level)]
+    return left if scores[left] <= scores[right] else right
+
+
+class BatchSmartChunker:
+    """
+    Chunks many documents at once. Sentences are split by the per-language splitter of SmartChunker and,
+    like in SmartChunker, the segment longer than max_chunk_length is split recursively on the sentence
+    boundary with the lowest reranker score, but every boundary is scored once with a fixed document level
+    context (context_length tokens on each side) instead of the context of the current segment, so chunks
+    can differ from SmartChunker. Boundaries of all documents are scored together: pairs are sorted by
+    token length and scored in batches of batch_size (minimal padding), scores are scattered back to their
+    documents. Scores depend only on the pair texts, so they can be cached.
+    """
+    def __init__(self, reranker, max_chunk_length: int, batch_size: int = 64, context_length: int = 128,
+                 score_cache=None, language: str = 'ru', newline_as_separator: bool = False, verbose: bool = False):
+        self.reranker = reranker    # torch or onnx reranker (see rerankers.py)
+        self.tokenizer = reranker.tokenizer
+        self.language = language
+        self.newline_as_separator = newline_as_separator
+        self.max_chunk_length = max_chunk_length
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.score_cache = score_cache
+        self.verbose = verbose
+
+    def split_into_sentences(self, text: str) -> List[str]:
+        # the same sentences as in SmartChunker: razdel for russian, nltk for english, too long sentences are
+        # split by words
+        from smart_chunker.sentenizer import split_text_into_sentences
+        return split_text_into_sentences(text, self.newline_as_separator, self.language,
+                                         (2 * self.max_chunk_length) // 3, self.tokenizer)
+
+    def sentences_lengths(self, sentences: List[str]) -> List[int]:
+        if len(sentences) == 0:
+            return []
+        encoded = self.tokenizer(sentences, add_special_tokens=False)['input_ids']
+        return [len(ids) for ids in encoded]
+
+    def _context_pair(self, sentences: List[str], lengths: List[int], split: int):
+        # left context - the last sentences before split, right context - the first ones after it
+        left_start, left_length = split, 0
+        while left_start > 0 and (left_length == 0 or left_length + lengths[left_start - 1] <= self.context_length):
+            left_start -= 1
+            left_length += lengths[left_start]
+        right_end, right_length = split, 0
+        while right_end < len(sentences) and \
+                (right_length == 0 or right_length + lengths[right_end] <= self.context_length):
+            right_length += lengths[right_end]
+            right_end += 1
+        pair = (' '.join(sentences[left_start:split]), ' '.join(sentences[split:right_end]))
+        return pair, left_length + right_length
+
+    def score_pairs(self, pairs: List[Tuple[str, str]], pair_lengths: List[int]) -> List[float]:
+        scores = [None] * len(pairs)
+        if self.score_cache is not None:
+            scores = self.score_cache.get_many(pairs)
+        order = sorted([idx for idx, score in enumerate(scores) if score is None], key=lambda idx: pair_lengths[idx])
+        if self.verbose:
+            print(f'candidate pairs: {len(pairs)}; scored by reranker: {len(order)}')
+
+        for batch_start in range(0, len(order), self.batch_size):
+            batch_idxs = order[batch_start: batch_start + self.batch_size]
+            batch_scores = self.reranker.score([list(pairs[idx]) for idx in batch_idxs])
+            for idx, score in zip(batch_idxs, batch_scores):
+                scores[idx] = score
+            if self.score_cache is not None:
+                self.score_cache.put_many([pairs[idx] for idx in batch_idxs], batch_scores)
+        return scores
+
+    def split_many_ranges(self, texts: List[str]):
+        # returns sentences of each document and sentence ranges [start, end) of its chunks
+        docs_sentences = [self.split_into_sentences(text) for text in texts]
+        docs_lengths = [self.sentences_lengths(sentences) for sentences in docs_sentences]
+        pairs, pair_lengths = [], []
+
+        # score boundaries of all documents together, boundary i is placed before sentence i
+        for sentences, lengths in zip(docs_sentences, docs_lengths):
+            for split in range(1, len(sentences)):
+                pair, pair_length = self._context_pair(sentences, lengths, split)
+                pairs.append(pair)
+                pair_lengths.append(pair_length)
+        scores = self.score_pairs(pairs, pair_lengths)
+        docs_chunks = []
+        offset = 0
+
+        for sentences, lengths in zip(docs_sentences, docs_lengths):
+            # boundary 0 is never a split
+            boundary_scores = [float('inf')] + scores[offset: offset + max(len(sentences) - 1, 0)]
+            offset += max(len(sentences) - 1, 0)
+            # segment length and its best split are found in O(1), so unbalanced splits aren't quadratic
+            prefix_lengths = [0]
+            for length in lengths:
+                prefix_lengths.append(prefix_lengths[-1] + length)
+            argmin_table = build_argmin_table(boundary_scores)
+            chunks = []   # (start, end) sentence ranges of the final chunks
+            pending = [(0, len(sentences))] if len(sentences) > 0 else []
+
+            while pending:
+                start, end = pending.pop()
+                if end - start == 1 or prefix_lengths[end] - prefix_lengths[start] <= self.max_chunk_length:
+                    chunks.append((start, end))
+                    continue
+                split = range_argmin(argmin_table, boundary_scores, start + 1, end)
+                pending.append((split, end))
+                pending.append((start, split))
+            docs_chunks.append(sorted(chunks))
+        return docs_sentences, docs_chunks
+
+    def split_many(self, texts: List[str]) -> List[List[str]]:
+        docs_sentences, docs_chunks = self.split_many_ranges(texts)
+        result = []
+
+        for sentences, chunks in zip(docs_sentences, docs_chunks):
+            result.append([' '.join(sentences[start:end]) for start, end in chunks])
+        return result
+
+    def split_into_chunks(self, text: str) -> List[str]:
+        return self.split_many([text])[0]
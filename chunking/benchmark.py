@@ -0,0 +1,80 @@
+from smart_chunker.chunker import SmartChunker
+from batch_chunker import BatchSmartChunker
+from rerankers import load_reranker
+from settings.settings import chunker_settings
+import argparse
+import sys
+import os
+import time
+import torch
+
+
+def read_texts(dir_path: str, max_files: int):
+    files = sorted(os.listdir(dir_path))[:max_files]
+    texts = []
+
+    for file in files:
+        with open(os.path.join(dir_path, file), 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    return texts
+
+
+def validate_args(args):
+    if not os.path.isdir(args.dir_path):
+        raise ValueError(f"Directory path '{args.dir_path}' does not exist or is not a directory.")
+    if args.max_files <= 0:
+        raise ValueError(f"max_files must be a positive integer. Got '{args.max_files}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare documents/sec of per-file SmartChunker loop '
+                                                 'and cross-document batched chunking')
+    parser.add_argument('--dir_path', type=str, required=True,
+                        help='directory with text files to chunk')
+    parser.add_argument('--max_files', type=int, required=False, default=100,
+                        help='maximum count of files to chunk')
+    parser.add_argument('--model_path', type=str, required=False, default=chunker_settings.model_path,
+                        help='path to the reranker model')
+    parser.add_argument('--lang', type=str, required=False, default=chunker_settings.lang,
+                        help="language of the text to process (available: 'ru', 'en')")
+    parser.add_argument('--chunk_size', type=int, required=False, default=chunker_settings.chunk_size,
+                        help='size of chunks')
+    parser.add_argument('--batch_size', type=int, required=False,
+                        default=chunker_settings.batching_settings.batch_size,
+                        help='reranker batch size of batched chunking')
+    try:
+        args = parser.parse_args()
+        validate_args(args)
+    except Exception as e:
+        print('Parse args exception: ' + repr(e), file=sys.stderr)
+        parser.print_help()
+        return
+    texts = read_texts(args.dir_path, args.max_files)
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+
+    chunker = SmartChunker(language=args.lang, reranker_name=args.model_path, newline_as_separator=False,
+                           device=device, max_chunk_length=args.chunk_size,
+                           minibatch_size=chunker_settings.minibatch_size, verbose=False)
+    start_time = time.perf_counter()
+    for text in texts:
+        chunker.split_into_chunks(text)
+    loop_time = time.perf_counter() - start_time
+    del chunker
+
+    reranker = load_reranker(args.model_path, device, chunker_settings.reranker_settings)
+    batch_chunker = BatchSmartChunker(reranker, args.chunk_size, batch_size=args.batch_size,
+                                      context_length=chunker_settings.batching_settings.context_length,
+                                      language=args.lang)
+    docs_per_batch = chunker_settings.batching_settings.docs_per_batch
+    start_time = time.perf_counter()
+    for group_start in range(0, len(texts), docs_per_batch):
+        batch_chunker.split_many(texts[group_start: group_start + docs_per_batch])
+    batch_time = time.perf_counter() - start_time
+
+    print(f'documents={len(texts)}; device={device}; reranker={chunker_settings.reranker_settings.backend}')
+    print(f'per-file loop: {len(texts) / loop_time:.2f} docs/sec ({loop_time:.1f}s)')
+    print(f'batched: {len(texts) / batch_time:.2f} docs/sec ({batch_time:.1f}s); speedup={loop_time / batch_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
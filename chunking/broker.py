@@ -1,12 +1,31 @@
 import pika
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from tracing import TRACE_HEADER, TRACE_ID_HEADER, TraceLog, now
+
+
+STAGE = 'chunker'
+DONE_EVENT = 'chunked'   # document is processed by the stage
 
 
 class BrokerAdapter:
-    def __init__(self, broker_host:str, broker_port: int, pipeline_mode:bool=False):
+    def __init__(self, broker_host:str, broker_port: int, pipeline_mode:bool=False, prefetch_count: int=None,
+                 in_flight: int=1, heartbeat: int=None, max_retries: int=5, base_delay_ms: int=1000,
+                 max_delay_ms: int=60000, trace_log: TraceLog=None):
         self.host = broker_host
         self.port = broker_port
         self.pipeline_mode = pipeline_mode
+        self.prefetch_count = prefetch_count    # None - in_flight messages
+        self.in_flight = in_flight  # count of messages processed at the same time
+        self.heartbeat = heartbeat  # None - value of the broker
+        # failed message is retried with exponential backoff, after max_retries it goes to dead-letter queue
+        self.max_retries = max_retries
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.trace_log = trace_log  # None - events of traced messages are passed on, but not logged
+        self.current = threading.local()    # trace of the message processed by the current thread
         self.init = False
 
         self.connection = None
@@ -16,36 +35,104 @@ class BrokerAdapter:
     def init_adapter(self):
         if not self.pipeline_mode:
             return # don't use broker in not pipeline mode
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host, port=self.port))
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host, port=self.port,
+                                                                            heartbeat=self.heartbeat))
+        self.connection_thread = threading.get_ident()
         self.channel = self.connection.channel()
         self.consume_queue_name = "formatter_queue"
 
         self.channel.queue_declare(queue=self.consume_queue_name)
+        self.declare_retry_queues()
 
         self.init = True
 
-    def consume_messages(self, infer_callback):
-        if not self.pipeline_mode:
+    def retry_delay(self, attempt: int) -> int:
+        return min(self.base_delay_ms * 2 ** (attempt - 1), self.max_delay_ms)
+
+    def retry_queue_name(self, delay: int) -> str:
+        return f'{self.consume_queue_name}.retry.{delay}'
+
+    def declare_retry_queues(self):
+        # message waits in delay queue for its ttl, then it's dead-lettered back to the consume queue
+        self.dead_queue_name = f'{self.consume_queue_name}.dead'
+        self.channel.queue_declare(queue=self.dead_queue_name)
+        for delay in sorted({self.retry_delay(attempt) for attempt in range(1, self.max_retries + 1)}):
+            self.channel.queue_declare(queue=self.retry_queue_name(delay),
+                                       arguments={'x-message-ttl': delay,
+                                                  'x-dead-letter-exchange': '',
+                                                  'x-dead-letter-routing-key': self.consume_queue_name})
+
+    def handle_failure(self, ch, delivery_tag, body: bytes, properties, error: Exception):
+        # called by connection thread: failed message is published to delay or dead-letter queue, then acked
+        headers = dict(properties.headers or {})
+        attempt = headers.get('x-retry-count', 0) + 1
+        headers['x-retry-count'] = attempt
+        headers['x-last-error'] = repr(error)[:1024]
+        if attempt > self.max_retries:
+            routing_key = self.dead_queue_name
+            headers['x-original-queue'] = self.consume_queue_name
+            print(f'message is moved to {routing_key} after {attempt - 1} retries - {body.decode()}')
+        else:
+            routing_key = self.retry_queue_name(self.retry_delay(attempt))
+        ch.basic_publish(exchange='', routing_key=routing_key, body=body,
+                         properties=pika.BasicProperties(headers=headers, delivery_mode=properties.delivery_mode))
+        ch.basic_ack(delivery_tag=delivery_tag)
+
+    def start_trace(self, properties):
+        # returns (trace id, events, retries count) of the traced message
+        headers = properties.headers or {}
+        if TRACE_ID_HEADER not in headers:
+            return None
+        trace = dict(headers.get(TRACE_HEADER) or {})
+        trace[f'{STAGE}.dequeued'] = now()
+        return headers[TRACE_ID_HEADER], trace, headers.get('x-retry-count', 0)
+
+    def finish_trace(self, msg: str):
+        trace = self.current.trace
+        if trace is None:
             return
-        if not self.init_adapter:
+        trace[1].setdefault(DONE_EVENT, now())
+        if self.trace_log is not None:
+            own_events = {event: ts for event, ts in trace[1].items()
+                          if event == DONE_EVENT or event.startswith(STAGE + '.')}
+            self.trace_log.write(trace[0], msg, own_events, trace[2])
+
+    def consume_messages(self, infer_callback):
+        """
+        Inference runs on worker threads, so connection thread keeps sending heartbeats during long
+        generation and the broker doesn't drop connection (and redeliver unacked message) in the middle
+        of it. Acks are sent back through connection thread with add_callback_threadsafe.
+        """
+        if not self.init:
             raise Exception('Broker Adapter is not initialized')
-        def consume_callback(ch, method, properties, body):
+        self.channel.basic_qos(prefetch_count=self.prefetch_count or self.in_flight)
+        executor = ThreadPoolExecutor(max_workers=self.in_flight)
+
+        def infer_task(ch, delivery_tag, body, properties, trace):
+            msg = body.decode()
+            self.current.trace = trace
+            if trace is not None:
+                trace[1][f'{STAGE}.started'] = now()
             try:
-                msg = body.decode()
                 infer_callback(msg)
-                ch.basic_ack(delivery_tag=method.delivery_tag)
+                self.finish_trace(msg)
+                self.connection.add_callback_threadsafe(partial(ch.basic_ack, delivery_tag=delivery_tag))
             except Exception as e:
                 print(f'exception {str(e)}; for message - {msg}')
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                self.connection.add_callback_threadsafe(partial(self.handle_failure, ch, delivery_tag, body,
+                                                                properties, e))
+
+        def consume_callback(ch, method, properties, body):
+            executor.submit(infer_task, ch, method.delivery_tag, body, properties, self.start_trace(properties))
         self.channel.basic_consume(queue=self.consume_queue_name,
                                     on_message_callback=consume_callback,
                                     auto_ack=False)
         try:
             self.channel.start_consuming()
         except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
             self.close()
             sys.exit(1)
-            
 
     def close(self):
         if not self.pipeline_mode:
@@ -0,0 +1,43 @@
+from typing import List
+from smart_chunker.chunker import SmartChunker
+
+
+class CachedSmartChunker(SmartChunker):
+    """
+    SmartChunker which takes reranker scores of sentence pairs from the score cache and can score the rest
+    with another reranker backend (e.g. onnx, see rerankers.py). Sentences, pairs and the chunks search are
+    the ones of SmartChunker, so chunks are the same with and without the cache, and the chunking with
+    another backend differs only by its scores.
+    """
+    def __init__(self, score_cache=None, reranker=None, **kwargs):
+        super().__init__(**kwargs)
+        self.score_cache = score_cache
+        # SmartChunker still loads its own model: its tokenizer and config are used to build pairs
+        self.reranker = reranker
+
+    def _score_pairs(self, pairs: List[List[str]]) -> List[float]:
+        if self.reranker is None:
+            return super()._calculate_similarity_func(pairs)
+        scores = []
+
+        # pairs are truncated as in SmartChunker
+        for batch_start in range(0, len(pairs), self.minibatch_size):
+            scores += self.reranker.score(pairs[batch_start: batch_start + self.minibatch_size],
+                                          max_length=self.model_.config.max_position_embeddings)
+        return scores
+
+    def _calculate_similarity_func(self, pairs: List[List[str]]) -> List[float]:
+        if self.score_cache is None:
+            return self._score_pairs(pairs)
+        scores = self.score_cache.get_many(pairs)
+        missed = [idx for idx, score in enumerate(scores) if score is None]
+        if self.verbose:
+            print(f'candidate pairs: {len(pairs)}; scored by reranker: {len(missed)}')
+        missed_pairs = [pairs[idx] for idx in missed]
+        missed_scores = self._score_pairs(missed_pairs)
+
+        for idx, score in zip(missed, missed_scores):
+            scores[idx] = score
+        if len(missed_pairs) > 0:
+            self.score_cache.put_many(missed_pairs, missed_scores)
+        return scores
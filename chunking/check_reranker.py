@@ -0,0 +1,103 @@
+from smart_chunker.chunker import SmartChunker
+from smart_chunking import create_chunker, use_batch_engine
+from settings.settings import chunker_settings
+import argparse
+import re
+import sys
+import os
+
+
+def get_boundaries(text: str, chunks):
+    # offsets of chunk starts (except the first chunk) in the text without whitespaces, chunkers change
+    # whitespaces; SmartChunker chunk can end with the first sentence of the next one, so every chunk is
+    # searched from the start of the previous one
+    compact_text = re.sub(r'\s+', '', text)
+    boundaries = set()
+    search_from = 0
+
+    for chunk in chunks:
+        pos = compact_text.find(re.sub(r'\s+', '', chunk), search_from)
+        if pos == -1:
+            continue
+        if pos > 0:
+            boundaries.add(pos)
+        search_from = pos + 1
+    return boundaries
+
+
+def validate_args(args):
+    if not os.path.isdir(args.dir_path):
+        raise ValueError(f"Directory path '{args.dir_path}' does not exist or is not a directory.")
+    if not 0 <= args.min_agreement <= 1:
+        raise ValueError(f"min_agreement should be in [0, 1]. Got '{args.min_agreement}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check that chunking with the configured reranker backend and '
+                                                 'engine (reranker_settings, batching_settings) gives the same chunk '
+                                                 'boundaries as SmartChunker with the torch model')
+    parser.add_argument('--dir_path', type=str, required=True,
+                        help='directory with text files to chunk')
+    parser.add_argument('--max_files', type=int, required=False, default=50,
+                        help='maximum count of files to chunk')
+    parser.add_argument('--model_path', type=str, required=False, default=chunker_settings.model_path,
+                        help='path to the reranker model')
+    parser.add_argument('--lang', type=str, required=False, default=chunker_settings.lang,
+                        help="language of the text to process (available: 'ru', 'en')")
+    parser.add_argument('--chunk_size', type=int, required=False, default=chunker_settings.chunk_size,
+                        help='size of chunks')
+    parser.add_argument('--min_agreement', type=float, required=False, default=0.95,
+                        help='minimal boundaries F1 between SmartChunker and the configured chunking to pass the check')
+    try:
+        args = parser.parse_args()
+        validate_args(args)
+    except Exception as e:
+        print('Parse args exception: ' + repr(e), file=sys.stderr)
+        parser.print_help()
+        return
+    texts = []
+    for file in sorted(os.listdir(args.dir_path))[:args.max_files]:
+        with open(os.path.join(args.dir_path, file), 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    # reference - chunks of the default setup (SmartChunker with torch model)
+    import torch
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    reference_chunker = SmartChunker(language=args.lang, reranker_name=args.model_path, newline_as_separator=False,
+                                     device=device, max_chunk_length=args.chunk_size,
+                                     minibatch_size=chunker_settings.minibatch_size)
+    reference_chunks = [reference_chunker.split_into_chunks(text) for text in texts]
+    del reference_chunker
+    # score cache is off, so all boundaries are scored by the checked backend
+    settings = chunker_settings.model_copy(update={'score_cache_settings': chunker_settings.score_cache_settings.
+                                                   model_copy(update={'use_cache': False})})
+    chunker = create_chunker(args, settings)
+    if use_batch_engine(settings):
+        checked_chunks = chunker.split_many(texts)
+    else:
+        checked_chunks = [chunker.split_into_chunks(text) for text in texts]
+
+    matched, reference_total, checked_total, same_docs = 0, 0, 0, 0
+    for text, expected, actual in zip(texts, reference_chunks, checked_chunks):
+        expected, actual = get_boundaries(text, expected), get_boundaries(text, actual)
+        matched += len(expected & actual)
+        reference_total += len(expected)
+        checked_total += len(actual)
+        same_docs += expected == actual
+    precision = matched / checked_total if checked_total > 0 else 1.0
+    recall = matched / reference_total if reference_total > 0 else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+    engine = 'batch' if use_batch_engine(settings) else 'smart'
+    reranker_settings = settings.reranker_settings
+    print(f'documents={len(texts)}; engine={engine}; backend={reranker_settings.backend}; '
+          f'quantize={reranker_settings.quantize}')
+    print(f'boundaries: reference={reference_total}; checked={checked_total}; matched={matched}; f1={f1:.3f}')
+    print(f'documents with identical chunking: {same_docs}/{len(texts)}')
+    if f1 < args.min_agreement:
+        print(f'FAILED: boundaries agreement {f1:.3f} < {args.min_agreement}', file=sys.stderr)
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
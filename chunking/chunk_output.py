@@ -0,0 +1,190 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from typing import List
+
+
+OUTPUT_FORMATS = ['text', 'jsonl', 'binary']
+INDEX_MAGIC = b'CHKIDX01'
+# index record: byte offset and byte length of chunk in .bin file, char offsets in source, token count
+INDEX_RECORD = struct.Struct('<QIqqI')
+
+
+def create_url_file_name(url: str):
+    # the same as create_url_file_name of the crawler (scrapping/html_tools.py)
+    cleaned_url = re.sub(r'^https?://', '', url)
+    cleaned_url = re.sub(r'^www\.', '', cleaned_url)
+    return cleaned_url.replace('/', '') \
+                        .replace('.', '') \
+                        .replace(':', '_') \
+                        .replace('?', '') + ".txt"
+
+
+def load_urls_map(meta_path: str) -> dict:
+    # file name -> source url, from crawler's meta file (urls.json)
+    if not meta_path or not os.path.isfile(meta_path):
+        return dict()
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta_dict = json.loads(f.read())
+    return {create_url_file_name(url): url for url in meta_dict}
+
+
+def find_offsets(source: str, chunks: List[str]) -> List[tuple]:
+    """
+    Finds char offsets [start, end) of chunks in source text. Chunkers can change whitespaces, so texts are
+    compared without them; chunks are searched sequentially. (-1, -1) is returned for chunk which isn't found.
+    """
+    positions = [idx for idx, c in enumerate(source) if not c.isspace()]
+    compact_source = ''.join(source[idx] for idx in positions)
+    result = []
+    search_from = 0
+
+    for chunk in chunks:
+        compact_chunk = re.sub(r'\s+', '', chunk)
+        pos = compact_source.find(compact_chunk, search_from) if compact_chunk else -1
+        if pos == -1:
+            result.append((-1, -1))
+            continue
+        result.append((positions[pos], positions[pos + len(compact_chunk) - 1] + 1))
+        search_from = pos + len(compact_chunk)
+    return result
+
+
+class ChunksSaver:
+    """
+    Saves chunks of the document in one of the formats:
+    - text: chunks joined with delimiter (previous format)
+    - jsonl: one record per chunk with text, char offsets in source, token count, source url and document hash
+    - binary: <name>.bin with utf-8 chunk texts, <name>.idx with fixed size records (see INDEX_RECORD)
+      for seek/mmap access to chunk N, and <name>.meta.json with document metadata
+    """
+    def __init__(self, output: str, output_format: str = 'text', delimiter: str = '\n'*4, tokenizer=None,
+                 urls_map: dict = None):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'unknown output format: {output_format}')
+        self.output = output
+        self.output_format = output_format
+        self.delimiter = delimiter
+        self.tokenizer = tokenizer
+        self.urls_map = urls_map if urls_map is not None else dict()
+
+    @property
+    def keeps_offsets(self) -> bool:
+        # text format has no offsets and document hash, so they aren't computed for it
+        return self.output_format != 'text'
+
+    def output_path(self, file_path: str) -> str:
+        file_name = os.path.basename(file_path)
+        if self.output_format == 'jsonl':
+            return os.path.join(self.output, os.path.splitext(file_name)[0] + '.jsonl')
+        if self.output_format == 'binary':
+            return os.path.join(self.output, os.path.splitext(file_name)[0] + '.bin')
+        return os.path.join(self.output, file_name)
+
+    def _tokens_counts(self, chunks: List[str]) -> List[int]:
+        if self.tokenizer is None or len(chunks) == 0:
+            return [-1] * len(chunks)
+        return [len(ids) for ids in self.tokenizer(chunks, add_special_tokens=False)['input_ids']]
+
+    def save(self, file_path: str, data: str, chunks: List[str]):
+        if not self.keeps_offsets:
+            writer = self.open_stream(file_path, None)
+            writer.write(chunks, None)
+            writer.close()
+            return
+        writer = self.open_stream(file_path, hashlib.sha256(data.encode('utf-8')).hexdigest())
+        writer.write(chunks, find_offsets(data, chunks))
+        writer.close()
+
+    def open_stream(self, file_path: str, doc_hash: str):
+        # writer to save chunks of the document as they are produced (see chunk_stream of smart_chunking.py)
+        return ChunksStreamWriter(self, file_path, doc_hash)
+
+
+class ChunksStreamWriter:
+    def __init__(self, saver: ChunksSaver, file_path: str, doc_hash: str):
+        self.saver = saver
+        self.file_path = file_path
+        self.doc_hash = doc_hash
+        self.source_url = saver.urls_map.get(os.path.basename(file_path))
+        self.output_path = saver.output_path(file_path)
+        self.count = 0
+        self.byte_offset = 0
+        self.last_text = None   # the last text chunk is kept to strip it on close
+        self.index_file = None
+
+        if saver.output_format == 'text':
+            self.file = open(self.output_path, 'w', encoding='utf-8')
+        elif saver.output_format == 'jsonl':
+            self.file = open(self.output_path, 'w', encoding='utf-8')
+        else:
+            self.file = open(self.output_path, 'wb')
+            self.index_file = open(os.path.splitext(self.output_path)[0] + '.idx', 'wb')
+            self.index_file.write(INDEX_MAGIC)
+
+    def write(self, chunks: List[str], offsets: List[tuple]):
+        # offsets - char offsets [start, end) of chunks in the whole source, not used by text format
+        if self.saver.output_format == 'text':
+            for chunk in chunks:
+                if self.last_text is None:
+                    self.last_text = chunk.lstrip()
+                    continue
+                self.file.write(self.last_text + self.saver.delimiter)
+                self.last_text = chunk
+            self.count += len(chunks)
+            return
+        tokens_counts = self.saver._tokens_counts(chunks)
+
+        for chunk, (start, end), n_tokens in zip(chunks, offsets, tokens_counts):
+            if self.saver.output_format == 'jsonl':
+                record = {'doc_hash': self.doc_hash, 'source_url': self.source_url, 'chunk_idx': self.count,
+                          'start': start, 'end': end, 'n_tokens': n_tokens, 'text': chunk}
+                self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            else:
+                encoded = chunk.encode('utf-8')
+                self.file.write(encoded)
+                self.index_file.write(INDEX_RECORD.pack(self.byte_offset, len(encoded), start, end, max(n_tokens, 0)))
+                self.byte_offset += len(encoded)
+            self.count += 1
+
+    def close(self):
+        if self.last_text is not None:
+            self.file.write(self.last_text.rstrip())
+        self.file.close()
+        if self.index_file is None:
+            return
+        self.index_file.close()
+        with open(os.path.splitext(self.output_path)[0] + '.meta.json', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'doc_hash': self.doc_hash, 'source_url': self.source_url,
+                                'source': os.path.abspath(self.file_path), 'chunks': self.count}, ensure_ascii=False))
+
+
+class BinaryChunksReader:
+    # memory-mapped reader of binary chunks output, chunk N is read without reading the whole file
+    def __init__(self, bin_path: str):
+        base_path = os.path.splitext(bin_path)[0]
+        with open(base_path + '.idx', 'rb') as f:
+            index_data = f.read()
+        if not index_data.startswith(INDEX_MAGIC):
+            raise ValueError(f'bad chunks index file: {base_path}.idx')
+        self.index = index_data[len(INDEX_MAGIC):]
+        self.file = open(bin_path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(bin_path) > 0 else b''
+
+    def __len__(self):
+        return len(self.index) // INDEX_RECORD.size
+
+    def get_record(self, idx: int) -> dict:
+        if not 0 <= idx < len(self):
+            raise IndexError(f'chunk index out of range: {idx}')
+        byte_offset, byte_length, start, end, n_tokens = INDEX_RECORD.unpack_from(self.index, idx * INDEX_RECORD.size)
+        text = bytes(self.data[byte_offset: byte_offset + byte_length]).decode('utf-8')
+        return {'chunk_idx': idx, 'start': start, 'end': end, 'n_tokens': n_tokens, 'text': text}
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
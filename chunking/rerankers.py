@@ -0,0 +1,78 @@
+import os
+from typing import List
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+
+RERANKER_BACKENDS = ['torch', 'onnx']
+MAX_PAIR_LENGTH = 512   # reranker max input length
+
+
+class TorchReranker:
+    def __init__(self, reranker_name: str, device: str):
+        self.tokenizer = AutoTokenizer.from_pretrained(reranker_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(reranker_name).to(device)
+        self.model.eval()
+        self.device = device
+
+    def score(self, pairs: List[List[str]], max_length: int = MAX_PAIR_LENGTH) -> List[float]:
+        inputs = self.tokenizer(pairs, padding=True, truncation=True, max_length=max_length,
+                                return_tensors='pt').to(self.device)
+        with torch.inference_mode():
+            return self.model(**inputs, return_dict=True).logits.view(-1).float().cpu().tolist()
+
+
+class OnnxReranker:
+    """
+    Reranker on ONNX Runtime for CPU-only nodes. The model is exported to onnx_dir once
+    (optionally with dynamic int8 quantization of weights) and reused on the next runs.
+    """
+    def __init__(self, reranker_name: str, onnx_dir: str, quantize: bool = True, intra_op_threads: int = 0,
+                 inter_op_threads: int = 1):
+        import onnxruntime
+        self.tokenizer = AutoTokenizer.from_pretrained(reranker_name)
+        model_dir = os.path.join(onnx_dir, reranker_name.replace('/', '_'))
+        model_path = os.path.join(model_dir, 'model.onnx')
+        quantized_path = os.path.join(model_dir, 'model_int8.onnx')
+        if not os.path.isfile(model_path):
+            self.export(reranker_name, model_path)
+        if quantize and not os.path.isfile(quantized_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads     # 0 - onnxruntime default (physical cores)
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(quantized_path if quantize else model_path, options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def export(self, reranker_name: str, model_path: str):
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        model = AutoModelForSequenceClassification.from_pretrained(reranker_name)
+        model.eval()
+        inputs = self.tokenizer([['query', 'passage']], return_tensors='pt')
+        input_names = list(inputs.keys())
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['logits'] = {0: 'batch'}
+
+        with torch.inference_mode():
+            torch.onnx.export(model, tuple(inputs[name] for name in input_names), model_path,
+                              input_names=input_names, output_names=['logits'], dynamic_axes=dynamic_axes,
+                              opset_version=17)
+
+    def score(self, pairs: List[List[str]], max_length: int = MAX_PAIR_LENGTH) -> List[float]:
+        inputs = self.tokenizer(pairs, padding=True, truncation=True, max_length=max_length, return_tensors='np')
+        feeds = {name: inputs[name] for name in self.input_names if name in inputs}
+        logits = self.session.run(['logits'], feeds)[0]
+        return logits.reshape(-1).astype('float32').tolist()
+
+
+def load_reranker(reranker_name: str, device: str, reranker_settings):
+    if reranker_settings.backend == 'torch':
+        return TorchReranker(reranker_name, device)
+    if reranker_settings.backend == 'onnx':
+        return OnnxReranker(reranker_name, reranker_settings.onnx_dir, reranker_settings.quantize,
+                            reranker_settings.intra_op_threads, reranker_settings.inter_op_threads)
+    raise ValueError(f'unknown reranker backend: {reranker_settings.backend}')
@@ -0,0 +1,59 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List, Tuple
+
+
+class ScoreCache:
+    """
+    Persistent cache of reranker scores of sentence pairs, keyed by hash of (model, language, backend, pair).
+    Stored in sqlite database (WAL mode), so several chunker processes can share it.
+    Connection is shared by consumer threads and guarded by the lock.
+    """
+    def __init__(self, cache_path: str, model_name: str, language: str, backend: str = 'torch'):
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.namespace = f'{model_name}\n{language}\n{backend}'    # scores of onnx (int8) model differ
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL NOT NULL)')
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, pair: Tuple[str, str]) -> str:
+        key_data = f'{self.namespace}\n{pair[0]}\x00{pair[1]}'
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get_many(self, pairs: List[Tuple[str, str]]) -> list:
+        keys = [self.make_key(pair) for pair in pairs]
+        found = dict()
+        step = 500  # sqlite limit of query variables
+
+        with self.lock:
+            for idx in range(0, len(keys), step):
+                part = keys[idx: idx + step]
+                query = f'SELECT key, score FROM scores WHERE key IN ({",".join("?" * len(part))})'
+                found.update(self.connection.execute(query, part).fetchall())
+            result = [found.get(key) for key in keys]
+            self.hits += sum(score is not None for score in result)
+            self.misses += sum(score is None for score in result)
+        return result
+
+    def put_many(self, pairs: List[Tuple[str, str]], scores: List[float]):
+        rows = [(self.make_key(pair), score) for pair, score in zip(pairs, scores)]
+        with self.lock:
+            self.connection.execute('BEGIN')
+            self.connection.executemany('INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)', rows)
+            self.connection.execute('COMMIT')
+
+    def report(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests if requests > 0 else 0.0
+        return f'score cache: hits={self.hits}; misses={self.misses}; hit rate={hit_rate:.1%}'
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
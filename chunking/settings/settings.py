@@ -1,12 +1,75 @@
 from pydantic import BaseModel
 import pydantic_core
+import os
 from pydantic import BaseModel
 
 
+# settings are found regardless of the working directory
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_PATH = os.path.join(SERVICE_DIR, 'settings', 'settings.json')
+
+
 class PipelineSettings(BaseModel):
     use_pipeline: bool
     broker_host: str
     broker_port: int
+    prefetch_count: int
+    in_flight: int
+    heartbeat: int
+
+
+class BatchingSettings(BaseModel):
+    use_batching: bool
+    batch_size: int
+    docs_per_batch: int
+    context_length: int
+
+
+class RerankerSettings(BaseModel):
+    backend: str
+    onnx_dir: str
+    quantize: bool
+    intra_op_threads: int
+    inter_op_threads: int
+
+
+class WorkersSettings(BaseModel):
+    workers: int
+    threads_per_worker: int
+
+
+class ScoreCacheSettings(BaseModel):
+    use_cache: bool
+    cache_path: str
+
+
+class IncrementalSettings(BaseModel):
+    incremental: bool
+    manifest_path: str
+    sniff_workers: int
+
+
+class OutputSettings(BaseModel):
+    output_format: str
+    meta_path: str
+
+
+class StreamingSettings(BaseModel):
+    use_streaming: bool
+    min_file_size: int
+    window_size: int
+    carry_chunks: int
+
+
+class RetrySettings(BaseModel):
+    max_retries: int
+    base_delay_ms: int
+    max_delay_ms: int
+
+
+class TracingSettings(BaseModel):
+    use_tracing: bool
+    trace_log: str
 
 
 class Settings(BaseModel):
@@ -16,11 +79,21 @@ class Settings(BaseModel):
     dir_path: str
     chunk_size: int
     pipeline_settings: PipelineSettings
+    retry_settings: RetrySettings
+    tracing_settings: TracingSettings
     lang: str
     delimiter: str
+    minibatch_size: int
+    batching_settings: BatchingSettings
+    reranker_settings: RerankerSettings
+    workers_settings: WorkersSettings
+    score_cache_settings: ScoreCacheSettings
+    incremental_settings: IncrementalSettings
+    output_settings: OutputSettings
+    streaming_settings: StreamingSettings
 
 
-with open('settings/settings.json', encoding='utf-8') as f:
+with open(SETTINGS_PATH, encoding='utf-8') as f:
     json_data = f.read()
 
 chunker_settings = Settings.model_validate(pydantic_core.from_json(json_data))
\ No newline at end of file
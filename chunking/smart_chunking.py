@@ -1,11 +1,18 @@
-from smart_chunker.chunker import SmartChunker
 from settings.settings import chunker_settings
 import argparse
 import sys
 import os
 from broker import BrokerAdapter
-import magic
-import torch
+from tracing import TraceLog
+from batch_chunker import BatchSmartChunker
+from score_cache import ScoreCache
+from manifest import Manifest, scan_text_files, settings_hash
+from chunk_output import ChunksSaver, OUTPUT_FORMATS, find_offsets, load_urls_map
+import hashlib
+import io
+import multiprocessing
+import threading
+from typing import List
 
 
 def validate_args(args):
@@ -28,6 +35,21 @@ def validate_args(args):
     # validate delimiter
     if not args.delimiter:
         raise ValueError("Delimiter cannot be empty.")
+    # validate output format
+    if args.output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output format '{args.output_format}'. Available formats: {OUTPUT_FORMATS}.")
+    if args.meta_path and not os.path.isfile(args.meta_path):
+        raise ValueError(f"Meta file '{args.meta_path}' does not exist.")
+    if chunker_settings.streaming_settings.use_streaming:
+        if chunker_settings.streaming_settings.window_size <= 0:
+            raise ValueError("Streaming window size must be a positive integer.")
+        if chunker_settings.streaming_settings.carry_chunks < 0:
+            raise ValueError("Count of carried chunks must be non negative.")
+    # validate workers
+    if args.workers <= 0:
+        raise ValueError(f"Workers count must be a positive integer. Got '{args.workers}'.")
+    if args.threads_per_worker < 0:
+        raise ValueError(f"Threads per worker must be non negative. Got '{args.threads_per_worker}'.")
 
     # skip file_path and dir_path validation if pipeline mode is enabled (files for processing are getting from broker)
     if not args.use_pipeline:
@@ -43,6 +65,7 @@ def validate_args(args):
 
 
 def is_text(file_path: str):
+    import magic
     try:
         return magic.from_file(file_path, mime=True).split('/')[0] == 'text'
     except Exception:
@@ -50,16 +73,256 @@ def is_text(file_path: str):
         return file_path.split(".")[-1] in ['txt', 'md']
 
 
-def chunk(file: str, output: str, chunker: SmartChunker, delimiter:str='\n'*4):
-    file_name = os.path.basename(file)
-
-    with open(file, 'r', encoding='utf-8') as f:
-        data = f.read()
+def chunk(file: str, saver: ChunksSaver, chunker, data: str = None):
+    # data - text of the document if it's already in memory (in-process pipeline), otherwise it's read from file
+    if use_streaming(file, data):
+        chunk_stream(file, saver, chunker, data)
+        return
+    if data is None:
+        with open(file, 'r', encoding='utf-8') as f:
+            data = f.read()
     chunks = chunker.split_into_chunks(data)
-    result_data = delimiter.join(chunks).strip()
+    saver.save(file, data, chunks)
+
+
+def chunk_many(files: List[str], saver: ChunksSaver, chunker: BatchSmartChunker):
+    # chunks group of files with one batched reranker pass
+    texts = []
+
+    # very large files are chunked separately by windows
+    for file in [file for file in files if use_streaming(file)]:
+        chunk_stream(file, saver, chunker)
+    files = [file for file in files if not use_streaming(file)]
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    docs_chunks = chunker.split_many(texts)
+
+    for file, data, chunks in zip(files, texts, docs_chunks):
+        saver.save(file, data, chunks)
+
+
+def use_streaming(file: str, data: str = None) -> bool:
+    streaming_settings = chunker_settings.streaming_settings
+    if not streaming_settings.use_streaming:
+        return False
+    size = len(data.encode('utf-8')) if data is not None else os.path.getsize(file)
+    return size >= streaming_settings.min_file_size
+
+
+def open_text(file: str, data: str = None):
+    # in-memory document is read as a file
+    return io.StringIO(data) if data is not None else open(file, 'r', encoding='utf-8')
+
+
+def read_windows(file: str, window_size: int, data: str = None):
+    # yields blocks of the file of about window_size chars, blocks are cut on line (or word) boundaries
+    rest = ''
+    with open_text(file, data) as f:
+        while True:
+            block = f.read(window_size)
+            if block == '':
+                break
+            block = rest + block
+            cut = block.rfind('\n') + 1 or block.rfind(' ') + 1 or len(block)
+            rest = block[cut:]
+            if cut > 0:
+                yield block[:cut]
+    if rest:
+        yield rest
+
+
+def chunk_stream(file: str, saver: ChunksSaver, chunker, data: str = None):
+    """
+    Chunks the document by windows, so memory depends on window size instead of document size. The last
+    carry_chunks chunks of the window are not written: their text is carried to the next window and chunked
+    again with the following text, so chunk boundaries aren't forced by window edges. Chunks are written
+    as soon as they are final. In-memory document (data) is chunked by the same windows as its file.
+    """
+    streaming_settings = chunker_settings.streaming_settings
+    doc_hash = None     # text format has no document hash, so the file isn't read twice
+    if saver.keeps_offsets:
+        sha = hashlib.sha256()
+        for block in read_windows(file, streaming_settings.window_size, data):
+            sha.update(block.encode('utf-8'))
+        doc_hash = sha.hexdigest()
+    writer = saver.open_stream(file, doc_hash)
+    carry, carry_offset = '', 0     # carried text and its char offset in the document
+    windows = read_windows(file, streaming_settings.window_size, data)
+    block = next(windows, None)
+
+    while block is not None:
+        next_block = next(windows, None)
+        window = carry + block
+        chunks = chunker.split_into_chunks(window)
+        offsets = find_offsets(window, chunks)
+        # chunks of the last window are final, otherwise the last ones are chunked again with the next window
+        final_count = len(chunks) if next_block is None else max(len(chunks) - streaming_settings.carry_chunks, 0)
+        if final_count < len(chunks) and offsets[final_count][0] == -1:
+            final_count = 0     # can't find the carried text in the window, carry the whole window
+        if final_count < len(chunks) and len(window) - max(offsets[final_count][0], 0) > streaming_settings.window_size:
+            final_count = len(chunks)   # carried text is bounded by window size
+        writer.write(chunks[:final_count], [(start + carry_offset, end + carry_offset) if start != -1 else (-1, -1)
+                                            for start, end in offsets[:final_count]])
+        carry_start = max(offsets[final_count][0], 0) if final_count < len(chunks) else len(window)
+        carry, carry_offset = window[carry_start:], carry_offset + carry_start
+        block = next_block
+    writer.close()
+
+
+def create_saver(args, chunker) -> ChunksSaver:
+    tokenizer = None
+    if args.output_format != 'text':
+        # token counts are computed with the reranker tokenizer
+        tokenizer = getattr(chunker, 'tokenizer', None)
+        if tokenizer is None:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+    return ChunksSaver(args.output, args.output_format, args.delimiter, tokenizer, load_urls_map(args.meta_path))
+
+
+def use_batch_engine(settings) -> bool:
+    return settings.batching_settings.use_batching
+
+
+def get_backend_name(settings) -> str:
+    reranker_settings = settings.reranker_settings
+    if reranker_settings.backend == 'onnx' and reranker_settings.quantize:
+        return 'onnx-int8'
+    return reranker_settings.backend
+
+
+def create_score_cache(args, settings):
+    if not settings.score_cache_settings.use_cache:
+        return None
+    return ScoreCache(settings.score_cache_settings.cache_path, args.model_path, args.lang,
+                      get_backend_name(settings))
+
+
+def create_chunker(args, settings, threads: int = 0):
+    # torch and reranker models are imported only when the model is loaded, so cli starts fast
+    import torch
+    from rerankers import load_reranker
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    reranker_settings = settings.reranker_settings
+    if threads > 0:
+        reranker_settings = reranker_settings.model_copy(update={'intra_op_threads': threads})
+    # chunking engine (use_batching) and reranker backend are selected independently
+    if use_batch_engine(settings):
+        return BatchSmartChunker(reranker=load_reranker(args.model_path, device, reranker_settings),
+                                 max_chunk_length=args.chunk_size,
+                                 batch_size=settings.batching_settings.batch_size,
+                                 context_length=settings.batching_settings.context_length,
+                                 score_cache=create_score_cache(args, settings),
+                                 language=args.lang,
+                                 verbose=True)
+    from cached_chunker import CachedSmartChunker
+    reranker = None
+    if reranker_settings.backend != 'torch':
+        reranker = load_reranker(args.model_path, device, reranker_settings)
+    return CachedSmartChunker(
+                score_cache=create_score_cache(args, settings),
+                reranker=reranker,
+                language=args.lang,
+                reranker_name=args.model_path,
+                newline_as_separator=False,
+                device=device,
+                max_chunk_length=args.chunk_size,
+                minibatch_size=settings.minibatch_size,
+                verbose=True
+              )
+
 
-    with open(os.path.join(output, file_name), 'w', encoding='utf-8') as f:
-        f.write(result_data)
+def create_trace_log():
+    if not chunker_settings.tracing_settings.use_tracing:
+        return None
+    return TraceLog(chunker_settings.tracing_settings.trace_log, 'chunker')
+
+
+def consume(chunker, args, prefetch_count: int = None, in_flight: int = None):
+    pipeline_settings = chunker_settings.pipeline_settings
+    adapter = BrokerAdapter(pipeline_settings.broker_host,
+                            pipeline_settings.broker_port,
+                            args.use_pipeline,
+                            prefetch_count=prefetch_count or pipeline_settings.prefetch_count or None,
+                            in_flight=in_flight or pipeline_settings.in_flight,
+                            heartbeat=pipeline_settings.heartbeat,
+                            max_retries=chunker_settings.retry_settings.max_retries,
+                            base_delay_ms=chunker_settings.retry_settings.base_delay_ms,
+                            max_delay_ms=chunker_settings.retry_settings.max_delay_ms,
+                            trace_log=create_trace_log())
+    adapter.init_adapter()
+    saver = create_saver(args, chunker)
+    # chunker and its tokenizer aren't thread safe, so documents of in_flight worker threads are chunked one
+    # by one (worker threads still keep the connection alive), use --workers for parallel chunking
+    chunk_lock = threading.Lock()
+    print('Waiting incoming messages...')
+
+    def infer_callback(file_path: str):
+        with chunk_lock:
+            chunk(file_path, saver, chunker)
+    adapter.consume_messages(infer_callback)
+
+
+worker_chunker = None   # chunker of the pool worker process
+worker_saver = None
+
+
+def init_worker(args, threads_per_worker: int):
+    global worker_chunker, worker_saver
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    worker_chunker = create_chunker(args, chunker_settings, threads_per_worker)
+    worker_saver = create_saver(args, worker_chunker)
+
+
+def chunk_files_worker(files: List[str]):
+    if isinstance(worker_chunker, BatchSmartChunker):
+        chunk_many(files, worker_saver, worker_chunker)
+    else:
+        for file in files:
+            chunk(file, worker_saver, worker_chunker)
+    return files
+
+
+def run_workers_pool(files: List[str], args, workers: int, threads_per_worker: int, saver: ChunksSaver,
+                     manifest: Manifest = None):
+    # files are spread across worker processes, each worker loads its own model copy
+    group_size = 1
+    if use_batch_engine(chunker_settings):
+        group_size = chunker_settings.batching_settings.docs_per_batch
+    groups = [files[idx: idx + group_size] for idx in range(0, len(files), group_size)]
+    context = multiprocessing.get_context('spawn')
+    chunked = 0
+
+    with context.Pool(workers, initializer=init_worker, initargs=(args, threads_per_worker)) as pool:
+        for chunked_files in pool.imap_unordered(chunk_files_worker, groups):
+            chunked += len(chunked_files)
+            record_files(manifest, chunked_files, saver)
+            print(f'{chunked}/{len(files)} files are chunked', flush=True)
+
+
+def record_files(manifest: Manifest, files: List[str], saver: ChunksSaver):
+    if manifest is None:
+        return
+    for file in files:
+        manifest.record(file, saver.output_path(file))
+
+
+def get_settings_key(args) -> str:
+    # hash of the settings which affect output
+    engine_settings = [get_backend_name(chunker_settings)]
+    if use_batch_engine(chunker_settings):
+        engine_settings.append(chunker_settings.batching_settings.context_length)
+    return settings_hash(args.model_path, args.lang, args.chunk_size, args.delimiter, engine_settings,
+                         args.output_format, args.meta_path)
+
+
+def consume_worker(args, threads_per_worker: int):
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    # fair dispatch: worker gets the next message only after the current one is processed
+    consume(create_chunker(args, chunker_settings, threads_per_worker), args, prefetch_count=1, in_flight=1)
 
 
 def parse_bool_str(arg:str):
@@ -69,7 +332,7 @@ def parse_bool_str(arg:str):
         raise argparse.ArgumentTypeError(f'invalid bool literal: {arg}')
 
 
-def main():
+def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--model_path', type=str, required=False, default=chunker_settings.model_path,
                         help='path to the model for processing')
@@ -88,6 +351,25 @@ def main():
                         help='weather use pipeline mode with message broker or not') 
     parser.add_argument('--delimiter', type=str, required=False, default=chunker_settings.delimiter,
                         help="delimiter between splitted chunks (default: '\\n\\n\\n\\n')")
+    parser.add_argument('--output_format', type=str, required=False,
+                        default=chunker_settings.output_settings.output_format,
+                        help=f'format of output files (available: {OUTPUT_FORMATS}). jsonl and binary formats keep '
+                             f'char offsets, token counts, source url and document hash of every chunk')
+    parser.add_argument('--meta_path', type=str, required=False, default=chunker_settings.output_settings.meta_path,
+                        help="crawler's meta file (urls.json) to get source urls of documents")
+    parser.add_argument('--incremental', type=parse_bool_str, required=False,
+                        default=chunker_settings.incremental_settings.incremental,
+                        help='chunk only new or changed files of --dir_path (processed files are kept in manifest)')
+    parser.add_argument('--workers', type=int, required=False, default=chunker_settings.workers_settings.workers,
+                        help='count of worker processes, each one with its own model copy')
+    parser.add_argument('--threads_per_worker', type=int, required=False,
+                        default=chunker_settings.workers_settings.threads_per_worker,
+                        help='torch threads of each worker (0 - cpu count divided by workers count)')
+    return parser
+
+
+def main():
+    parser = create_parser()
     try:
         args = parser.parse_args()
         validate_args(args)
@@ -98,36 +380,23 @@ def main():
     output = args.output
     file_path = args.file_path
     dir_path = args.dir_path
-    delimiter = args.delimiter
+    workers = args.workers
+    # each worker gets fixed count of torch threads, so workers don't oversubscribe cores
+    threads_per_worker = args.threads_per_worker or max((os.cpu_count() or 1) // workers, 1)
 
-    chunker = SmartChunker(
-                language=args.lang,
-                reranker_name=args.model_path,
-                newline_as_separator=False,
-                device='cuda:0' if torch.cuda.is_available() else 'cpu',
-                max_chunk_length=args.chunk_size,
-                minibatch_size=8,
-                verbose=True
-              )
     if args.use_pipeline:
         # use broker:
-        adapter = BrokerAdapter(chunker_settings.pipeline_settings.broker_host, 
-                                chunker_settings.pipeline_settings.broker_port, 
-                                args.use_pipeline)
-        adapter.init_adapter()
-        print('Waiting incoming messages...')
-
-        def infer_callback(file_path: str):
-            file_name = os.path.basename(file_path)
-
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = f.read()
-            chunks = chunker.split_into_chunks(data)
-            result_text = delimiter.join(chunks)
-
-            with open(os.path.join(output, file_name), 'w', encoding='utf-8') as f:
-                f.write(result_text.strip())
-        adapter.consume_messages(infer_callback)
+        if workers > 1:
+            # every worker is a separate broker consumer with its own model copy
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=consume_worker, args=(args, threads_per_worker))
+                         for _ in range(workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            return
+        consume(create_chunker(args, chunker_settings), args)
     else:
         # run as simple python script
         if file_path != "":
@@ -135,21 +404,48 @@ def main():
                 print(f"WARNING: {file_path} - is not a text file, so can't be chunked")
                 return
             # chunking:
-            chunk(file_path, output, chunker, delimiter=delimiter)
+            chunker = create_chunker(args, chunker_settings)
+            chunk(file_path, create_saver(args, chunker), chunker)
         else:
-            files = os.listdir(dir_path)
             # select only text files:
-            files = [f for f in [os.path.join(dir_path, _) for _ in files] if is_text(f)]
+            files = scan_text_files(dir_path, is_text, chunker_settings.incremental_settings.sniff_workers)
 
             if len(files) == 0:
                 print(f'WARNING: no text files exists here - {dir_path}, nothing to chunk')
                 return
+            manifest = None
+            # output paths only, token counts aren't needed to check manifest
+            paths_saver = ChunksSaver(output, args.output_format)
+            if args.incremental:
+                # only new or changed files (or files chunked with other settings) are chunked
+                manifest = Manifest(chunker_settings.incremental_settings.manifest_path, get_settings_key(args))
+                files = manifest.filter_changed(files, paths_saver.output_path)
+                print(f'incremental mode: {len(files)} new or changed files')
+                if len(files) == 0:
+                    return
+            if workers > 1:
+                run_workers_pool(files, args, workers, threads_per_worker, paths_saver, manifest)
+                return
+            chunker = create_chunker(args, chunker_settings)
+            saver = create_saver(args, chunker)
 
-            for file in files:
-                chunk(file, output, chunker, delimiter=delimiter)
-                # chunking
-                print(f'file {os.path.basename(file)} is chunked', flush=True)
+            if isinstance(chunker, BatchSmartChunker):
+                # documents are chunked in groups, reranker pairs of the whole group are batched together
+                docs_per_batch = chunker_settings.batching_settings.docs_per_batch
+                for group_start in range(0, len(files), docs_per_batch):
+                    group = files[group_start: group_start + docs_per_batch]
+                    chunk_many(group, saver, chunker)
+                    record_files(manifest, group, saver)
+                    print(f'{group_start + len(group)}/{len(files)} files are chunked', flush=True)
+            else:
+                for file in files:
+                    chunk(file, saver, chunker)
+                    record_files(manifest, [file], saver)
+                    # chunking
+                    print(f'file {os.path.basename(file)} is chunked', flush=True)
+            if chunker.score_cache is not None:
+                print(chunker.score_cache.report())
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import re
+import threading
+import time
+import zlib
+from typing import List
+from generation_guard import GuardLogitsProcessor, create_guard
+
+
+BACKENDS = ['vllm', 'openai', 'stub']
+
+
+class GenerationRequest:
+    def __init__(self, token_ids: List[int], source_text: str, max_tokens: int):
+        self.token_ids = token_ids      # full prompt token ids
+        self.source_text = source_text  # text of the chunk to be formatted
+        self.max_tokens = max_tokens
+
+
+class GenerationResult:
+    def __init__(self, text: str, prompt_tokens: int, output_tokens: int, cached_tokens: int = 0,
+                 prefill_time: float = None, degenerate: bool = False):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens  # prompt tokens taken from prefix cache
+        self.prefill_time = prefill_time    # None if backend doesn't report it
+        self.degenerate = degenerate        # generation was stopped by guard or run out of max tokens
+
+
+class InferenceBackend:
+    """
+    Generates formatted texts for the batch of requests, results are returned in the requests order.
+    """
+    def generate(self, requests: List[GenerationRequest], sampling_params: dict) -> List[GenerationResult]:
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class VllmBackend(InferenceBackend):
+    """
+    In-process vLLM engine, the whole batch is scheduled by vLLM at once. The engine isn't thread safe,
+    batches of concurrent consumer threads are generated one by one.
+    Degeneration guard stops sequences through the logits processor, if the engine doesn't support
+    per request logits processors, the guard is applied to the finished outputs.
+    """
+    def __init__(self, model_name: str, enable_prefix_caching: bool = True, guard_settings=None):
+        from vllm import LLM
+        self.model = LLM(model=model_name, enable_prefix_caching=enable_prefix_caching)
+        self.guard_settings = guard_settings
+        self.eos_token_id = self.model.get_tokenizer().eos_token_id
+        self.logits_processors_supported = True
+        self.lock = threading.Lock()
+
+    def _generate(self, requests: List[GenerationRequest], sampling_params: dict, guards: list):
+        from vllm import SamplingParams
+        params = []
+
+        for request, guard in zip(requests, guards):
+            logits_processors = None
+            if guard is not None and self.logits_processors_supported:
+                logits_processors = [GuardLogitsProcessor(guard, self.eos_token_id)]
+            params.append(SamplingParams(**sampling_params, max_tokens=request.max_tokens,
+                                         logits_processors=logits_processors))
+        prompts = [{'prompt_token_ids': request.token_ids} for request in requests]
+        return self.model.generate(prompts, params, use_tqdm=False)
+
+    def generate(self, requests: List[GenerationRequest], sampling_params: dict) -> List[GenerationResult]:
+        guards = [create_guard(self.guard_settings) for _ in requests]
+        with self.lock:
+            try:
+                outputs = self._generate(requests, sampling_params, guards)
+            except (ValueError, NotImplementedError):
+                if not self.logits_processors_supported or all(guard is None for guard in guards):
+                    raise
+                self.logits_processors_supported = False
+                guards = [create_guard(self.guard_settings) for _ in requests]
+                outputs = self._generate(requests, sampling_params, guards)
+        assert len(outputs) == len(requests)
+        results = []
+
+        for output, guard in zip(outputs, guards):
+            completion = output.outputs[0]
+            if guard is not None and not self.logits_processors_supported:
+                guard.extend(completion.token_ids)
+            degenerate = completion.finish_reason == 'length' or (guard is not None and guard.tripped)
+            metrics = getattr(output, 'metrics', None)
+            first_scheduled = getattr(metrics, 'first_scheduled_time', None)
+            first_token = getattr(metrics, 'first_token_time', None)
+            prefill_time = None
+            if first_scheduled is not None and first_token is not None:
+                prefill_time = first_token - first_scheduled
+            results.append(GenerationResult(completion.text,
+                                            len(output.prompt_token_ids),
+                                            len(completion.token_ids),
+                                            getattr(output, 'num_cached_tokens', None) or 0,
+                                            prefill_time,
+                                            degenerate))
+        return results
+
+
+class OpenAIBackend(InferenceBackend):
+    """
+    Client of OpenAI-compatible completions API (e.g. vLLM server). Prompts are sent as token ids,
+    requests of the batch are sent concurrently through the pool of keep-alive connections.
+    Completions are streamed, degenerated stream is closed by the guard (server aborts the request).
+    Event loop runs on its own thread, so batches of concurrent consumer threads are sent together.
+    """
+    def __init__(self, model_name: str, api_url: str, api_key: str = "", max_in_flight: int = 16,
+                 timeout: int = 600, guard_settings=None):
+        import httpx
+        self.model_name = model_name
+        self.url = api_url.rstrip('/') + '/v1/completions'
+        self.max_in_flight = max_in_flight
+        self.guard_settings = guard_settings
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        headers = {'Authorization': f'Bearer {api_key}'} if api_key else None
+        limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+        self.http_client = httpx.AsyncClient(timeout=timeout, limits=limits, headers=headers)
+
+    async def _generate_one(self, request: GenerationRequest, sampling_params: dict, semaphore: asyncio.Semaphore):
+        payload = {'model': self.model_name,
+                   'prompt': request.token_ids,
+                   'max_tokens': request.max_tokens,
+                   'stream': True,
+                   'stream_options': {'include_usage': True},
+                   **sampling_params}
+        guard = create_guard(self.guard_settings)
+        text_parts = []
+        usage = {}
+        finish_reason = None
+
+        async with semaphore:
+            async with self.http_client.stream('POST', self.url, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    data = json.loads(data)
+                    usage = data.get('usage') or usage
+                    for choice in data.get('choices') or []:
+                        text_parts.append(choice.get('text', ''))
+                        finish_reason = choice.get('finish_reason') or finish_reason
+                        if guard is not None and guard.add(choice.get('text', '')):
+                            break
+                    if guard is not None and guard.tripped:
+                        break   # stream is closed, request is aborted by server
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        degenerate = finish_reason == 'length' or (guard is not None and guard.tripped)
+
+        return GenerationResult(''.join(text_parts),
+                                usage.get('prompt_tokens', len(request.token_ids)),
+                                usage.get('completion_tokens', len(text_parts)),
+                                cached_tokens,
+                                degenerate=degenerate)
+
+    async def _generate(self, requests: List[GenerationRequest], sampling_params: dict):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        coros = [self._generate_one(request, sampling_params, semaphore) for request in requests]
+        return await asyncio.gather(*coros)
+
+    def generate(self, requests: List[GenerationRequest], sampling_params: dict) -> List[GenerationResult]:
+        return list(asyncio.run_coroutine_threadsafe(self._generate(requests, sampling_params), self.loop).result())
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.http_client.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+
+
+class StubBackend(InferenceBackend):
+    """
+    Deterministic CPU stand-in of the model: returns the source text as formatted one after a delay of
+    latency_ms + ms_per_token * (tokens count). Requests of one batch are 'processed' in parallel.
+    """
+    def __init__(self, latency_ms: float = 0.0, ms_per_token: float = 0.0):
+        self.latency_ms = latency_ms
+        self.ms_per_token = ms_per_token
+
+    def generate(self, requests: List[GenerationRequest], sampling_params: dict) -> List[GenerationResult]:
+        results = []
+        max_tokens = 0
+
+        for request in requests:
+            output_ids = StubTokenizer.tokenize(request.source_text)[:request.max_tokens]
+            text = ''.join(output_ids)
+            results.append(GenerationResult(text, len(request.token_ids), len(output_ids)))
+            max_tokens = max(max_tokens, len(request.token_ids) + len(output_ids))
+        if requests:
+            time.sleep((self.latency_ms + self.ms_per_token * max_tokens) / 1000)
+        return results
+
+
+class StubTokenizer:
+    # whitespace-aware tokenizer with the subset of HF tokenizer interface used by formatter
+    TOKEN_PATTERN = re.compile(r'\s*\S{1,4}|\s+')
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return StubTokenizer.TOKEN_PATTERN.findall(text)
+
+    def __call__(self, text: str, add_special_tokens: bool = False, return_offsets_mapping: bool = False):
+        result = {'input_ids': self.encode(text)}
+        if return_offsets_mapping:
+            result['offset_mapping'] = [m.span() for m in self.TOKEN_PATTERN.finditer(text)]
+        return result
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[int]:
+        return [zlib.crc32(token.encode('utf-8')) % 65536 for token in self.tokenize(text)]
+
+    def apply_chat_template(self, messages: List[dict], tokenize: bool = False, add_generation_prompt: bool = True):
+        text = ''.join(f"<|{message['role']}|>\n{message['content']}\n" for message in messages)
+        if add_generation_prompt:
+            text += '<|assistant|>\n'
+        return text
+
+
+def load_backend(backend_settings, model_name: str, enable_prefix_caching: bool = True, guard_settings=None):
+    backend_name = backend_settings.backend
+    if backend_name == 'stub':
+        return StubBackend(backend_settings.stub_latency_ms, backend_settings.stub_ms_per_token), StubTokenizer()
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if backend_name == 'vllm':
+        return VllmBackend(model_name, enable_prefix_caching, guard_settings), tokenizer
+    if backend_name == 'openai':
+        return OpenAIBackend(model_name, backend_settings.api_url, backend_settings.api_key,
+                             backend_settings.max_in_flight, guard_settings=guard_settings), tokenizer
+    raise Exception(f'unknown inference backend: {backend_name}')
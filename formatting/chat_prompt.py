@@ -0,0 +1,73 @@
+import hashlib
+from typing import List
+
+
+USER_QUERY_MARKER = '<<USER_QUERY>>'
+
+
+class ChatPrompt:
+    """
+    Few-shot chat prompt tokenized once. The chat template is rendered with a marker instead of the
+    user query and split on it, so only the user query (and short template suffix) is tokenized per request,
+    the shared prefix token ids are reused and can be taken from vLLM prefix cache.
+    """
+    def __init__(self, tokenizer, chat_template: List[dict]):
+        self.tokenizer = tokenizer
+        messages = chat_template + [{'role': 'user', 'content': USER_QUERY_MARKER}]
+        text = tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        if text.count(USER_QUERY_MARKER) != 1:
+            raise Exception('can\'t split chat template on prefix and suffix')
+        prefix, self.suffix = text.split(USER_QUERY_MARKER)
+        self.prompt_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.prefix_ids = tokenizer.encode(prefix, add_special_tokens=False)
+
+    def get_token_ids(self, user_query: str) -> List[int]:
+        return self.prefix_ids + self.tokenizer.encode(user_query + self.suffix, add_special_tokens=False)
+
+
+class GenerationStats:
+    """
+    Collects prompt, prefix cache hit and output tokens of the generated requests and generation wall time.
+    Saved prefill time is estimated from the prefill time of uncached tokens (if backend reports it).
+    """
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.prefill_time = 0.0
+        self.saved_time = 0.0
+        self.generate_time = 0.0
+        self.edits_applied = 0
+        self.edits_failed = 0  # edit answers which can't be parsed, chunk is regenerated
+        self.degenerate = 0     # generations stopped by guard or max tokens
+
+    def add(self, result):
+        self.requests += 1
+        self.prompt_tokens += result.prompt_tokens
+        self.cached_tokens += result.cached_tokens
+        self.output_tokens += result.output_tokens
+        self.degenerate += result.degenerate
+
+        if result.prefill_time is not None:
+            self.prefill_time += result.prefill_time
+            uncached_tokens = max(result.prompt_tokens - result.cached_tokens, 1)
+            self.saved_time += result.prefill_time * result.cached_tokens / uncached_tokens
+
+    def report(self) -> str:
+        if self.requests == 0:
+            return 'generation: no requests'
+        hit_rate = self.cached_tokens / max(self.prompt_tokens, 1)
+        result = f'generation: requests={self.requests}; output tokens={self.output_tokens}; ' \
+                 f'time={self.generate_time:.2f}s; degenerate={self.degenerate}\n' \
+                 f'prefill: prompt tokens={self.prompt_tokens}; cached tokens={self.cached_tokens} ({hit_rate:.1%})'
+        if self.prefill_time > 0:
+            result += f'; prefill time per chunk={self.prefill_time / self.requests * 1000:.1f}ms; ' \
+                      f'saved per chunk~{self.saved_time / self.requests * 1000:.1f}ms'
+        if self.edits_applied + self.edits_failed > 0:
+            result += f'\nedit mode: applied={self.edits_applied}; fallback to rewrite={self.edits_failed}'
+        return result
@@ -0,0 +1,52 @@
+import re
+from typing import List, Optional
+
+
+EDIT_QUERY_PREFIX = 'edit this text:\n'
+DROP_PATTERN = re.compile(r'^\s*drop\s*:\s*(.*?)\s*$', re.IGNORECASE | re.MULTILINE)
+RANGE_PATTERN = re.compile(r'^(\d+)\s*(?:-\s*(\d+))?$')
+# edit operations are short, tokens budget depends on the lines count only
+EDIT_TOKENS_PER_LINE = 4
+EDIT_TOKENS_SLACK = 16
+
+
+def split_lines(text: str) -> List[str]:
+    # lines with their line endings, so joined lines give the source text
+    return text.splitlines(keepends=True)
+
+
+def create_edit_query(lines: List[str]) -> str:
+    return EDIT_QUERY_PREFIX + ''.join(f'{idx}| {line.rstrip()}\n' for idx, line in enumerate(lines, start=1))
+
+
+def get_edit_max_tokens(n_lines: int) -> int:
+    return n_lines * EDIT_TOKENS_PER_LINE + EDIT_TOKENS_SLACK
+
+
+def parse_edit_ops(output: str, n_lines: int) -> Optional[set]:
+    """
+    Parses model answer 'drop: 1-3, 7' (or 'drop: none') to the set of dropped line numbers (1-based).
+    Returns None if answer can't be parsed or refers to non-existing lines.
+    """
+    match = DROP_PATTERN.search(output)
+    if match is None:
+        return None
+    ops = match.group(1).strip().rstrip('.')
+    if ops.lower() in {'none', ''}:
+        return set()
+    dropped = set()
+
+    for item in ops.split(','):
+        range_match = RANGE_PATTERN.match(item.strip())
+        if range_match is None:
+            return None
+        first = int(range_match.group(1))
+        last = int(range_match.group(2)) if range_match.group(2) is not None else first
+        if first < 1 or last > n_lines or first > last:
+            return None
+        dropped.update(range(first, last + 1))
+    return dropped
+
+
+def apply_edit_ops(lines: List[str], dropped: set) -> str:
+    return ''.join(line for idx, line in enumerate(lines, start=1) if idx not in dropped)
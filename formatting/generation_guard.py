@@ -0,0 +1,74 @@
+from collections import Counter, deque
+
+
+class RepetitionGuard:
+    """
+    Detects degenerate generation (repetition loops) in the stream of generated items (token ids or words).
+    Keeps n-grams of the last `window` items, the sequence is degenerate if the share of repeated n-grams
+    in the full window exceeds max_repeat_ratio. Each item is processed in O(1).
+    """
+    def __init__(self, ngram_size: int, window: int, max_repeat_ratio: float):
+        self.ngram_size = ngram_size
+        self.window = window
+        self.max_repeat_ratio = max_repeat_ratio
+        self.tripped = False
+        self.tripped_at = None  # count of items when degeneration was detected
+
+        self._items = deque(maxlen=ngram_size)
+        self._ngrams = deque()
+        self._counts = Counter()
+        self._repeated = 0  # count of n-grams in window which are not unique
+        self._seen = 0
+
+    def add(self, item) -> bool:
+        self._seen += 1
+        self._items.append(item)
+        if self.tripped or len(self._items) < self.ngram_size:
+            return self.tripped
+        ngram = tuple(self._items)
+        self._ngrams.append(ngram)
+        self._counts[ngram] += 1
+        if self._counts[ngram] > 1:
+            self._repeated += 1
+        if len(self._ngrams) > self.window:
+            old = self._ngrams.popleft()
+            if self._counts[old] > 1:
+                self._repeated -= 1
+            self._counts[old] -= 1
+            if self._counts[old] == 0:
+                del self._counts[old]
+        if len(self._ngrams) >= self.window and self._repeated / len(self._ngrams) > self.max_repeat_ratio:
+            self.tripped = True
+            self.tripped_at = self._seen
+        return self.tripped
+
+    def extend(self, items) -> bool:
+        for item in items:
+            if self.add(item):
+                break
+        return self.tripped
+
+
+class GuardLogitsProcessor:
+    """
+    vLLM logits processor: feeds new output tokens to the guard and forces EOS when generation degenerates.
+    """
+    def __init__(self, guard: RepetitionGuard, eos_token_id: int):
+        self.guard = guard
+        self.eos_token_id = eos_token_id
+        self._processed = 0
+
+    def __call__(self, output_token_ids, logits):
+        if not self.guard.tripped:
+            self.guard.extend(output_token_ids[self._processed:])
+            self._processed = len(output_token_ids)
+        if self.guard.tripped:
+            logits.fill_(float('-inf'))
+            logits[self.eos_token_id] = 0.0
+        return logits
+
+
+def create_guard(guard_settings):
+    if guard_settings is None or not guard_settings.use_guard:
+        return None
+    return RepetitionGuard(guard_settings.ngram_size, guard_settings.window, guard_settings.max_repeat_ratio)
@@ -0,0 +1,41 @@
+# formatting/language_id.py and scrapping/language_id.py are the same file (every service is built from its own
+# directory), change formatting/language_id.py and copy it to the crawler
+ENGLISH_WORDS = {'the', 'and', 'of', 'to', 'is', 'that', 'for', 'with', 'are', 'this', 'from', 'have', 'which',
+                 'by', 'be', 'it', 'or', 'not', 'on', 'at'}
+MIN_LANG_WORDS = 20     # shorter latin text is treated as english
+MIN_ENGLISH_WORDS_RATIO = 0.08
+MAX_MODEL_TEXT_LENGTH = 2000    # text prefix which is enough for fastText model
+
+
+def detect_by_script(text: str) -> str:
+    # script based detection of the supported languages, other scripts are unknown
+    letters = [c for c in text if c.isalpha()]
+    cyrillic_ratio = sum('а' <= c.lower() <= 'я' or c in 'ёЁ' for c in letters) / max(len(letters), 1)
+    if cyrillic_ratio >= 0.5:
+        return 'ru'
+    latin_ratio = sum('a' <= c.lower() <= 'z' for c in letters) / max(len(letters), 1)
+    if latin_ratio < 0.5:
+        return 'unknown'
+    # other latin script languages (de, fr, es, ...) have almost no english function words
+    words = [word.strip('.,:;!?()"\'').lower() for word in text.split()]
+    english_words_ratio = sum(word in ENGLISH_WORDS for word in words) / max(len(words), 1)
+    if len(words) >= MIN_LANG_WORDS and english_words_ratio < MIN_ENGLISH_WORDS_RATIO:
+        return 'unknown'
+    return 'en'
+
+
+class LanguageDetector:
+    """
+    Language id with fastText model (e.g. lid.176.ftz) if model_path is set, otherwise by script.
+    """
+    def __init__(self, model_path: str = ''):
+        self.model = None
+        if model_path:
+            import fasttext     # optional dependency (fasttext-wheel)
+            self.model = fasttext.load_model(model_path)
+
+    def detect(self, text: str) -> str:
+        if self.model is None:
+            return detect_by_script(text)
+        labels, _ = self.model.predict(text[:MAX_MODEL_TEXT_LENGTH].replace('\n', ' '))
+        return labels[0].replace('__label__', '')
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+
+def scan_text_files(dir_path: str, is_text: Callable[[str], bool], workers: int = 8) -> List[str]:
+    # lists regular files with os.scandir and sniffs their types in parallel
+    with os.scandir(dir_path) as entries:
+        files = sorted(entry.path for entry in entries if entry.is_file())
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        text_flags = list(executor.map(is_text, files))
+    return [file for file, text_flag in zip(files, text_flags) if text_flag]
+
+
+def file_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def settings_hash(*settings) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    Manifest of processed files: (input path, size, mtime, content hash, settings hash) -> output.
+    Records are appended to the jsonl file after every processed file (the last record of the path wins),
+    so interrupted run can be restarted and only new or changed inputs are processed again.
+    """
+    def __init__(self, manifest_path: str, settings_key: str):
+        self.manifest_path = manifest_path
+        self.settings_key = settings_key
+        self.records = dict()
+
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue    # line is broken by interruption
+                    self.records[record['input']] = record
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir and not os.path.isdir(manifest_dir):
+            os.makedirs(manifest_dir, exist_ok=True)
+        self.file = open(manifest_path, 'a', encoding='utf-8')
+
+    def is_up_to_date(self, input_path: str, output_path: str) -> bool:
+        input_path = os.path.abspath(input_path)
+        record = self.records.get(input_path)
+        if record is None or record['settings'] != self.settings_key or record['output'] != os.path.abspath(output_path):
+            return False
+        if not os.path.isfile(output_path):
+            return False
+        stat = os.stat(input_path)
+        if stat.st_size == record['size'] and stat.st_mtime == record['mtime']:
+            return True
+        if stat.st_size != record['size']:
+            return False
+        # mtime is changed (e.g. file is rewritten by crawler), but content can be the same
+        if file_hash(input_path) != record['hash']:
+            return False
+        self.record(input_path, output_path, record['hash'])
+        return True
+
+    def filter_changed(self, files: List[str], get_output: Callable[[str], str]) -> List[str]:
+        return [file for file in files if not self.is_up_to_date(file, get_output(file))]
+
+    def record(self, input_path: str, output_path: str, content_hash: str = None):
+        input_path = os.path.abspath(input_path)
+        stat = os.stat(input_path)
+        record = {'input': input_path,
+                  'size': stat.st_size,
+                  'mtime': stat.st_mtime,
+                  'hash': content_hash if content_hash is not None else file_hash(input_path),
+                  'settings': self.settings_key,
+                  'output': os.path.abspath(output_path)}
+        self.records[input_path] = record
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
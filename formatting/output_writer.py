@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import re
+
+
+class CheckpointedWriter:
+    """
+    Writes formatted chunks to the output file in chunks order as they are completed.
+    After each written chunk sidecar checkpoint file (output + '.ckpt') stores the count of finished chunks
+    and the output size, so restarted job for the same input continues from the first unfinished chunk.
+    With keep_text the written text is also kept in memory (see text()).
+    """
+    def __init__(self, output: str, job_key: str, keep_text: bool = False):
+        self.output = output
+        self.checkpoint_path = output + '.ckpt'
+        self.job_key = job_key  # identifies input text and chunking settings
+        self.done_chunks = 0
+        self._pending = dict()  # completed chunks waiting for the previous ones
+        self._text_parts = [] if keep_text else None
+        offset = 0
+
+        checkpoint = self._read_checkpoint()
+        if checkpoint is not None and checkpoint['job_key'] == job_key and os.path.isfile(output) \
+                and os.path.getsize(output) >= checkpoint['offset']:
+            self.done_chunks = checkpoint['done_chunks']
+            offset = checkpoint['offset']
+        if offset > 0:
+            self.file = open(output, 'r+b')
+            self.file.truncate(offset)  # drop data written after the last checkpoint
+            if keep_text:
+                self._text_parts.append(self.file.read(offset).decode('utf-8'))
+            self.file.seek(offset)
+        else:
+            self.file = open(output, 'wb')
+
+    @staticmethod
+    def make_job_key(data: str, *settings) -> str:
+        key_data = json.dumps([hashlib.sha256(data.encode('utf-8')).hexdigest(), *settings])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _read_checkpoint(self):
+        if not os.path.isfile(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                return json.loads(f.read())
+        except Exception:
+            return None     # broken checkpoint, start from scratch
+
+    def _write_checkpoint(self):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'job_key': self.job_key,
+                                'done_chunks': self.done_chunks,
+                                'offset': self.file.tell()}))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def write(self, chunk_idx: int, text: str):
+        if chunk_idx < self.done_chunks:
+            return  # already written before restart
+        self._pending[chunk_idx] = text
+
+        while self.done_chunks in self._pending:
+            chunk = self._pending.pop(self.done_chunks)
+            if chunk != "" and re.search(r'\s$', chunk) is None:
+                chunk = " " + chunk
+            self.file.write(chunk.encode('utf-8'))
+            if self._text_parts is not None:
+                self._text_parts.append(chunk)
+            self.done_chunks += 1
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._write_checkpoint()
+
+    def text(self) -> str:
+        return ''.join(self._text_parts)
+
+    def finish(self):
+        self.file.close()
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def close(self):
+        # close without finishing, checkpoint is kept for the resume
+        self.file.close()
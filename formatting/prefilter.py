@@ -0,0 +1,79 @@
+import re
+import threading
+from language_id import LanguageDetector
+
+
+PASS = 'pass'   # chunk is clean, it's written as is
+DROP = 'drop'   # chunk is junk, it's dropped
+LLM = 'llm'     # chunk should be formatted by the model
+
+MARKUP_PATTERN = re.compile(r'https?://|www\.|[<>{}\[\]|#*_=~^\\]{2,}|&[a-z]+;|</?[a-z]+>|\|')
+JUNK_PATTERN = re.compile(r'cookie|куки|политик\w* конфиденциальности|privacy policy|all rights reserved|'
+                          r'все права защищены|javascript', re.IGNORECASE)
+JUNK_CHUNK_LENGTH = 400     # short chunk with junk pattern is dropped
+
+
+class ChunkFeatures:
+    def __init__(self, text: str):
+        non_space = [c for c in text if not c.isspace()]
+        n_non_space = max(len(non_space), 1)
+        letters = [c for c in non_space if c.isalpha()]
+        self.letters_ratio = len(letters) / n_non_space
+        self.digits_ratio = sum(c.isdigit() for c in non_space) / n_non_space
+
+        lines = [line.strip() for line in text.splitlines() if line.strip() != ""]
+        self.n_lines = len(lines)
+        self.mean_line_length = sum(len(line) for line in lines) / max(self.n_lines, 1)
+        self.lines = lines
+        self.markup_artifacts = len(MARKUP_PATTERN.findall(text))
+        self.has_junk = JUNK_PATTERN.search(text) is not None
+        self.length = len(text.strip())
+
+
+class ChunkPrefilter:
+    """
+    Cheap CPU scoring of chunks before the model: character classes ratios, line length statistics,
+    markup artifacts and language id. Each chunk is routed to pass-through, drop or LLM formatting.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.language_detector = LanguageDetector(settings.lang_model_path)
+        self.lock = threading.Lock()    # chunks are routed by consumer worker threads
+        self.counts = {PASS: 0, DROP: 0, LLM: 0}    # running totals over all processed documents
+
+    def _route(self, text: str) -> str:
+        settings = self.settings
+        features = ChunkFeatures(text)
+        if features.length == 0:
+            return DROP
+        if features.letters_ratio < settings.drop_max_letters_ratio:
+            return DROP     # mostly digits or symbols
+        if features.has_junk and features.length < JUNK_CHUNK_LENGTH:
+            return DROP     # cookie banners, copyright and s.o.
+        short_lines = sum(len(line) < settings.short_line_length for line in features.lines)
+        short_lines_share = short_lines / max(features.n_lines, 1)
+        if features.n_lines >= settings.min_list_lines and short_lines_share >= settings.drop_min_short_lines_share:
+            return DROP     # link lists, menus
+        if settings.allowed_languages and self.language_detector.detect(text) not in settings.allowed_languages:
+            return DROP
+        if features.letters_ratio >= settings.pass_min_letters_ratio \
+                and features.mean_line_length >= settings.pass_min_mean_line_length \
+                and short_lines_share <= settings.pass_max_short_lines_share \
+                and features.markup_artifacts <= settings.pass_max_markup_artifacts \
+                and not features.has_junk:
+            return PASS     # clean prose
+        return LLM
+
+    def route(self, text: str) -> str:
+        result = self._route(text)
+        with self.lock:
+            self.counts[result] += 1
+        return result
+
+    def report(self) -> str:
+        with self.lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        avoided = (counts[PASS] + counts[DROP]) / total if total > 0 else 0.0
+        return f'prefilter totals: pass={counts[PASS]}; drop={counts[DROP]}; llm={counts[LLM]}; ' \
+               f'gpu calls avoided={avoided:.1%}'
@@ -1,95 +1,233 @@
-from transformers import AutoTokenizer
-from vllm import LLM, SamplingParams
 from typing import List
+import copy
 import re
+import threading
+import time
 from tqdm import tqdm
 import argparse
 import sys
 import os
-import magic
 import json
 from settings.settings import formatter_settings
 from broker import BrokerAdapter
+from tracing import TraceLog
+from text_splitter import split_on_chunks, TextChunk
+from chat_prompt import ChatPrompt, GenerationStats
+from result_cache import ResultCache
+from output_writer import CheckpointedWriter
+from prefilter import ChunkPrefilter, PASS, DROP
+from backends import InferenceBackend, GenerationRequest, load_backend, BACKENDS
+from manifest import Manifest, scan_text_files, settings_hash, file_hash
+from edit_ops import split_lines, create_edit_query, get_edit_max_tokens, parse_edit_ops, apply_edit_ops
 
 
 MAX_TOKENS = 8192
-
-
-def split_on_chunks(input_file:str, chunk_size: int):
-    st_idx = 0
-    end_idx = st_idx + chunk_size
-    chunks = []
-
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = str(f.read())
-
-    while st_idx < len(data):
-        chunk = data[st_idx: end_idx]
-        if end_idx < len(data) - 1 and re.search(r'\s$', chunk) is None:
-            last_space = re.search(r'\s\S*$', chunk)
-            if last_space is None:
-                raise Exception('bad text: no spaces detected')
-            chunk_end_idx = last_space.span()[0]
-            chunk = chunk[:chunk_end_idx]
-            end_idx = st_idx + chunk_end_idx
-        chunks.append(chunk)
-        st_idx = end_idx
-        end_idx = min(st_idx + chunk_size, len(data))
-
-    return chunks
-
-
-def infer_chat(model, tokenizer, chat_template: List[dict], user_query: str, max_tokens: int = MAX_TOKENS):
-    sampling_params = SamplingParams(temperature=0.7, top_p=0.8, repetition_penalty=1.05, max_tokens=max_tokens)
-    messages = chat_template + [{'role': 'user', 'content': user_query}]
-
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-    outputs = model.generate([text], sampling_params)
-    assert len(outputs) == 1
-
-    return outputs[0].outputs[0].text
-
-
-def refactor_doc(file_path: str, few_shot_prompt: List[dict], output: str, model, tokenizer, chunk_size: int):
-    def add_chunk(result, chunk):
-        if re.search(r'\s$', chunk) is None:
-            return result + " " + chunk
-        return result + chunk
-
-    # chunk size is equal to max tokens
+# formatted text is expected to be not longer than the source one, a small slack is left for generation
+OUTPUT_TOKENS_RATIO = 1.1
+OUTPUT_TOKENS_SLACK = 16
+QUERY_PREFIX = 'refactor this text: '
+# generation is stopped if model starts a new dialog turn
+SAMPLING_PARAMS = {'temperature': 0.7, 'top_p': 0.8, 'repetition_penalty': 1.05,
+                   'stop': ['<|im_start|>', QUERY_PREFIX.strip()]}
+# edit operations should be exact, so greedy decoding is used, the answer is a single line
+EDIT_SAMPLING_PARAMS = {'temperature': 0.0, 'top_p': 1.0, 'repetition_penalty': 1.0, 'stop': ['\n']}
+OUTPUT_MODES = ['rewrite', 'edit']
+
+
+def get_max_tokens(n_tokens: int) -> int:
+    return min(int(n_tokens * OUTPUT_TOKENS_RATIO) + OUTPUT_TOKENS_SLACK, MAX_TOKENS)
+
+
+def infer_chat(backend: InferenceBackend, chat_prompt: ChatPrompt, queries: List[str], source_texts: List[str],
+               max_tokens: List[int], sampling_params: dict = SAMPLING_PARAMS, stats: GenerationStats = None,
+               cache: ResultCache = None) -> List[str]:
+    # generates answers for the batch of queries, cached results are taken without generation,
+    # degenerated answers (repetition loops, max tokens exceeding) are returned as None
+    results = [None] * len(queries)
+    cache_keys = [None] * len(queries)
+    requests = []
+    request_idxs = []
+
+    for idx, (user_query, source_text, n_tokens) in enumerate(zip(queries, source_texts, max_tokens)):
+        if cache is not None:
+            key_params = {**sampling_params, 'max_tokens': n_tokens, 'prompt': chat_prompt.prompt_hash}
+            cache_keys[idx] = cache.make_key(key_params, user_query)
+            results[idx] = cache.get(cache_keys[idx])
+            if results[idx] is not None:
+                continue    # cache hit, no generation is needed
+        # few-shot prefix is tokenized once, so token ids are passed to the model directly
+        requests.append(GenerationRequest(chat_prompt.get_token_ids(user_query), source_text, n_tokens))
+        request_idxs.append(idx)
+    if len(requests) > 0:
+        start_time = time.perf_counter()
+        outputs = backend.generate(requests, sampling_params)
+        if stats is not None:
+            stats.generate_time += time.perf_counter() - start_time
+
+        for idx, output in zip(request_idxs, outputs):
+            if stats is not None:
+                stats.add(output)
+            if output.degenerate:
+                continue
+            results[idx] = output.text
+            if cache is not None:
+                cache.put(cache_keys[idx], output.text)
+
+    return results
+
+
+def format_chunks(backend: InferenceBackend, chat_prompt: ChatPrompt, chunks: List[TextChunk],
+                  stats: GenerationStats = None, cache: ResultCache = None, edit_prompt: ChatPrompt = None):
+    results = [None] * len(chunks)
+    if edit_prompt is not None:
+        # edit mode: model returns lines to drop, they are applied to the source chunk locally
+        chunks_lines = [split_lines(chunk.text) for chunk in chunks]
+        answers = infer_chat(backend, edit_prompt, [create_edit_query(lines) for lines in chunks_lines],
+                             [chunk.text for chunk in chunks],
+                             [get_edit_max_tokens(len(lines)) for lines in chunks_lines],
+                             sampling_params=EDIT_SAMPLING_PARAMS, stats=stats, cache=cache)
+        for idx, (lines, answer) in enumerate(zip(chunks_lines, answers)):
+            dropped = parse_edit_ops(answer, len(lines)) if answer is not None else None
+            if dropped is not None:
+                results[idx] = apply_edit_ops(lines, dropped)
+            if stats is not None:
+                stats.edits_applied += dropped is not None
+                stats.edits_failed += dropped is None
+    # full regeneration (fallback for unparsed edits)
+    rewrite_idxs = [idx for idx, result in enumerate(results) if result is None]
+    rewrite_chunks = [chunks[idx] for idx in rewrite_idxs]
+    rewritten = infer_chat(backend, chat_prompt, [QUERY_PREFIX + chunk.text for chunk in rewrite_chunks],
+                           [chunk.text for chunk in rewrite_chunks],
+                           [get_max_tokens(chunk.n_tokens) for chunk in rewrite_chunks],
+                           stats=stats, cache=cache)
+    for idx, result in zip(rewrite_idxs, rewritten):
+        # source text is passed through if generation is degenerated
+        results[idx] = result if result is not None else chunks[idx].text
+
+    return results
+
+
+def refactor_doc(file_path: str, chat_prompt: ChatPrompt, output: str, backend: InferenceBackend, tokenizer,
+                 chunk_size: int, cache: ResultCache = None, batch_size: int = 1, prefilter: ChunkPrefilter = None,
+                 edit_prompt: ChatPrompt = None, data: str = None, return_text: bool = False):
+    # chunk size is a token budget, max tokens is set from the real chunk token count
+    # data - text of the document if it's already in memory (in-process pipeline), otherwise it's read from file
     print(f'file path={file_path}')
-    data_chunks = split_on_chunks(file_path, chunk_size)
-    result = ""
-    pbar = tqdm(len(data_chunks))
-
-    for chunk in data_chunks:
-        filtered_chunk = infer_chat(model, tokenizer, few_shot_prompt, 'refactor this text: ' + chunk, max_tokens=chunk_size)
-        result = add_chunk(result, filtered_chunk)
-        pbar.update(1)
-
-    with open(output, 'w', encoding='utf-8') as o:
-        o.write(result)
-
-
-def load_model(model_name: str):
-    llm = LLM(model=model_name)
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if data is None:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = str(f.read())
+    data_chunks = split_on_chunks(data, tokenizer, chunk_size)
+    # chunks are streamed to the output, the job is resumed from the first unfinished chunk
+    job_key = CheckpointedWriter.make_job_key(data, chunk_size, chat_prompt.prompt_hash,
+                                              edit_prompt.prompt_hash if edit_prompt is not None else None)
+    writer = CheckpointedWriter(output, job_key, keep_text=return_text)
+    if writer.done_chunks > 0:
+        print(f'resume from chunk {writer.done_chunks}/{len(data_chunks)}')
+    pbar = tqdm(total=len(data_chunks), initial=writer.done_chunks)
+    stats = GenerationStats()
 
-    return llm, tokenizer
+    try:
+        for batch_start in range(writer.done_chunks, len(data_chunks), batch_size):
+            batch = data_chunks[batch_start: batch_start + batch_size]
+            filtered_chunks = [None] * len(batch)
+            # clean chunks are passed through and junk chunks are dropped without the model
+            routes = [prefilter.route(chunk.text) if prefilter is not None else None for chunk in batch]
+            for idx, route in enumerate(routes):
+                if route == PASS:
+                    filtered_chunks[idx] = batch[idx].text
+                elif route == DROP:
+                    filtered_chunks[idx] = ""
+            llm_idxs = [idx for idx, filtered_chunk in enumerate(filtered_chunks) if filtered_chunk is None]
+            llm_results = format_chunks(backend, chat_prompt, [batch[idx] for idx in llm_idxs],
+                                        stats=stats, cache=cache, edit_prompt=edit_prompt)
+            for idx, llm_result in zip(llm_idxs, llm_results):
+                filtered_chunks[idx] = llm_result
+            for chunk_idx, filtered_chunk in enumerate(filtered_chunks, start=batch_start):
+                writer.write(chunk_idx, filtered_chunk)
+            pbar.update(len(batch))
+    except BaseException:
+        writer.close()
+        raise
+    writer.finish()
+    pbar.close()
+    print(stats.report())
+    if prefilter is not None:
+        print(prefilter.report())
+    if cache is not None:
+        print(cache.report())
+    if return_text:
+        return writer.text()
+
+
+def load_edit_prompt(tokenizer, output_mode: str):
+    if output_mode != 'edit':
+        return None
+    return ChatPrompt(tokenizer, read_json(formatter_settings.edit_prompt_file))
+
+
+def copy_prompts(tokenizer, args):
+    # fast tokenizers aren't thread safe, so every consumer worker thread gets its own tokenizer and prompts
+    tokenizer = copy.deepcopy(tokenizer)
+    return tokenizer, ChatPrompt(tokenizer, read_json(args.prompt_file)), load_edit_prompt(tokenizer, args.output_mode)
+
+
+def get_backend_settings(args):
+    return formatter_settings.backend_settings.model_copy(update={'backend': args.backend})
+
+
+def load_model(args):
+    # returns backend, its tokenizer and chat prompts
+    backend, tokenizer = load_backend(get_backend_settings(args), args.model_path,
+                                      formatter_settings.enable_prefix_caching, formatter_settings.guard_settings)
+    chat_prompt = ChatPrompt(tokenizer, read_json(args.prompt_file))
+    edit_prompt = load_edit_prompt(tokenizer, args.output_mode)
+    return backend, tokenizer, chat_prompt, edit_prompt
+
+
+def create_cache(args):
+    if not formatter_settings.cache_settings.use_cache:
+        return None
+    return ResultCache(formatter_settings.cache_settings.cache_path, formatter_settings.cache_settings.max_size_mb,
+                       args.model_path, args.prompt_file)
+
+
+def create_trace_log():
+    if not formatter_settings.tracing_settings.use_tracing:
+        return None
+    return TraceLog(formatter_settings.tracing_settings.trace_log, 'formatter')
+
+
+def create_prefilter():
+    if not formatter_settings.prefilter_settings.use_prefilter:
+        return None
+    return ChunkPrefilter(formatter_settings.prefilter_settings)
+
+
+def get_settings_key(args) -> str:
+    # hash of the settings which affect output
+    edit_prompt_hash = file_hash(formatter_settings.edit_prompt_file) if args.output_mode == 'edit' else None
+    return settings_hash(args.model_path, args.chunk_size, args.output_mode, args.backend,
+                         file_hash(args.prompt_file), edit_prompt_hash,
+                         formatter_settings.prefilter_settings.model_dump(),
+                         formatter_settings.guard_settings.model_dump())
 
 
 def validate_args(args):
     if args.chunk_size < 100:
         raise Exception(f'invalid chunk size={args.chunk_size}, should be 100 at least')
+    if args.chunk_size > MAX_TOKENS:
+        raise Exception(f'invalid chunk size={args.chunk_size}, should be {MAX_TOKENS} tokens at most')
     if args.file_path.strip() != "" and not os.path.isfile(args.file_path):  # file is specified but doesn't exist
         raise Exception(f"file - {args.file_path} doesn't exists")
     if args.prompt_file.strip() == "":
         raise Exception(f'empty system prompt')
-    if not os.path.isdir(args.dir_path) and args.file_path.strip() == "":
+    # prompts are read after the model is loaded, so they are checked beforehand
+    if not os.path.isfile(args.prompt_file):
+        raise Exception(f"prompt file - {args.prompt_file} doesn't exists")
+    if args.output_mode == 'edit' and not os.path.isfile(formatter_settings.edit_prompt_file):
+        raise Exception(f"edit prompt file - {formatter_settings.edit_prompt_file} doesn't exists")
+    # input isn't validated in pipeline mode, documents are received from the previous stage
+    if not args.use_pipeline and not os.path.isdir(args.dir_path) and args.file_path.strip() == "":
         raise Exception(f"input dir - {args.dir_path} doesn't exists and no input file is specified")
     if not os.path.isdir(args.output):
         os.mkdir(args.output)
@@ -104,6 +242,7 @@ def read_json(file_path:str):
 
 
 def is_text(file_path: str):
+    import magic
     try:
         return magic.from_file(file_path, mime=True).split('/')[0] == 'text'
     except Exception:
@@ -129,7 +268,7 @@ def parse_bool_str(arg:str):
         raise argparse.ArgumentTypeError(f'invalid bool literal: {arg}')
     
 
-def main():
+def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--model_path', type=str, required=False, default=formatter_settings.model_path,
                         help='model path on disk')
@@ -141,11 +280,25 @@ def main():
                         help='directory to get files on refactoring from. this argument is ignored if '
                              '--file_path is specified')
     parser.add_argument('--chunk_size', type=int, required=False, default=formatter_settings.chunk_size,
-                        help="chunk size of text splitting for one model inference iteration")
+                        help="token budget of one text chunk for one model inference iteration")
     parser.add_argument('--prompt_file', type=str, required=False, default=formatter_settings.prompt_file,
                         help='json file with few-shot prompt')
     parser.add_argument('--use_pipeline', type=parse_bool_str, default=formatter_settings.pipeline_settings.use_pipeline,
                         help='weather to use pipeline mode with message broker or not')
+    parser.add_argument('--output_mode', type=str, required=False, default=formatter_settings.output_mode,
+                        choices=OUTPUT_MODES,
+                        help="'rewrite' - model regenerates the whole chunk, 'edit' - model returns lines to drop "
+                             "(falls back to 'rewrite' if the answer can't be parsed)")
+    parser.add_argument('--incremental', type=parse_bool_str, default=formatter_settings.incremental_settings.incremental,
+                        help='process only new or changed files of --dir_path (processed files are kept in manifest)')
+    parser.add_argument('--backend', type=str, required=False, default=formatter_settings.backend_settings.backend,
+                        choices=BACKENDS,
+                        help="inference backend: in-process 'vllm', 'openai' compatible server or CPU 'stub'")
+    return parser
+
+
+def main():
+    parser = create_parser()
     try:
         args = parser.parse_args()
         validate_args(args)
@@ -153,14 +306,14 @@ def main():
         print('Parse args exception: ' + repr(e), file=sys.stderr)
         parser.print_help()
         return
-    model_path = args.model_path
     chunk_size = args.chunk_size
     output = args.output
     file_path = args.file_path
     dir_path = args.dir_path
-    prompt_path = args.prompt_file
-    few_shot_prompt = read_json(prompt_path)
     use_pipeline=args.use_pipeline
+    backend_settings = get_backend_settings(args)
+    cache = create_cache(args)
+    prefilter = create_prefilter()
 
     if not use_pipeline:
         if file_path != "":
@@ -168,35 +321,62 @@ def main():
             if not is_text(file_path):
                 print(f"WARNING: {file_path} - is not a text file, so can't be filtered")
                 return
-            model, tokenizer = load_model(model_path)
-            refactor_doc(file_path, few_shot_prompt, os.path.join(output, name + ext),
-                        model, tokenizer, chunk_size)
+            backend, tokenizer, chat_prompt, edit_prompt = load_model(args)
+            refactor_doc(file_path, chat_prompt, os.path.join(output, name + ext),
+                        backend, tokenizer, chunk_size, cache=cache, batch_size=backend_settings.batch_size,
+                        prefilter=prefilter, edit_prompt=edit_prompt)
         else:
-            files = os.listdir(dir_path)
             # select only text files:
-            files = [f for f in [os.path.join(dir_path, _) for _ in files] if is_text(f)]
+            files = scan_text_files(dir_path, is_text, formatter_settings.incremental_settings.sniff_workers)
 
             if len(files) == 0:
                 print(f'WARNING: no text files exists here - {dir_path}, nothing to filter')
                 return
-            model, tokenizer = load_model(model_path)
+            manifest = None
+            if args.incremental:
+                # only new or changed files (or files processed with other settings) are refactored
+                manifest = Manifest(formatter_settings.incremental_settings.manifest_path, get_settings_key(args))
+                files = manifest.filter_changed(files, lambda file: os.path.join(output, os.path.basename(file)))
+                print(f'incremental mode: {len(files)} new or changed files')
+                if len(files) == 0:
+                    return
+            backend, tokenizer, chat_prompt, edit_prompt = load_model(args)
 
             for file in files:
                 name, ext = os.path.splitext(os.path.basename(file))
-                refactor_doc(file, few_shot_prompt, os.path.join(output, name + ext),
-                            model, tokenizer, chunk_size)
+                refactor_doc(file, chat_prompt, os.path.join(output, name + ext),
+                            backend, tokenizer, chunk_size, cache=cache, batch_size=backend_settings.batch_size,
+                            prefilter=prefilter, edit_prompt=edit_prompt)
+                if manifest is not None:
+                    manifest.record(file, os.path.join(output, name + ext))
                 print(f'file {name + ext} is refactored', flush=True)
     else:
-        adapter = BrokerAdapter(formatter_settings.pipeline_settings.broker_host,
-                                formatter_settings.pipeline_settings.broker_port,
-                                use_pipeline)
+        # vllm backend generates batches of concurrent messages one by one, openai backend sends them together
+        pipeline_settings = formatter_settings.pipeline_settings
+        adapter = BrokerAdapter(pipeline_settings.broker_host,
+                                pipeline_settings.broker_port,
+                                use_pipeline,
+                                prefetch_count=pipeline_settings.prefetch_count or None,
+                                in_flight=pipeline_settings.in_flight,
+                                heartbeat=pipeline_settings.heartbeat,
+                                max_retries=formatter_settings.retry_settings.max_retries,
+                                base_delay_ms=formatter_settings.retry_settings.base_delay_ms,
+                                max_delay_ms=formatter_settings.retry_settings.max_delay_ms,
+                                trace_log=create_trace_log())
         adapter.init_adapter()
-        model, tokenizer = load_model(model_path)                              
+        backend, tokenizer, chat_prompt, edit_prompt = load_model(args)
+        # backend is shared by worker threads (vllm backend is locked), tokenizer and prompts are per thread
+        thread_prompts = threading.local()
         print('Waiting for incoming messages...')
         def infer_callback(file_path: str):
             nonlocal adapter
+            if not hasattr(thread_prompts, 'tokenizer'):
+                thread_prompts.tokenizer, thread_prompts.chat_prompt, thread_prompts.edit_prompt = \
+                    copy_prompts(tokenizer, args)
             file_name = os.path.basename(file_path)
-            refactor_doc(file_path, few_shot_prompt, os.path.join(output, file_name), model, tokenizer, chunk_size)
+            refactor_doc(file_path, thread_prompts.chat_prompt, os.path.join(output, file_name), backend,
+                         thread_prompts.tokenizer, chunk_size, cache=cache, batch_size=backend_settings.batch_size,
+                         prefilter=prefilter, edit_prompt=thread_prompts.edit_prompt)
             full_path = os.path.abspath(os.path.join(output, file_name))
             adapter.push_message(full_path)   # file is processed send it to chunker
         adapter.consume_messages(infer_callback)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class ResultCache:
+    """
+    Disk-backed cache of formatting results, keyed by hash of (model, prompt file content, sampling params, query).
+    Stored in sqlite database (WAL mode), so several consumer processes can share it.
+    Total size of stored results is bounded, least recently used records are evicted first.
+    Connection is shared by consumer threads and guarded by the lock.
+    """
+    EVICTION_CHECK_PERIOD = 64  # check total size once per this count of puts
+
+    def __init__(self, cache_path: str, max_size_mb: int, model_name: str, prompt_file: str):
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.max_size = max_size_mb * 1024 * 1024
+        with open(prompt_file, 'rb') as f:
+            prompt_hash = hashlib.sha256(f.read()).hexdigest()
+        self.namespace = f'{model_name}\n{prompt_hash}'
+
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(cache_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                                'last_access REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)')
+
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+    def make_key(self, sampling_params: dict, query: str) -> str:
+        key_data = json.dumps([self.namespace, sampling_params, query], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str):
+        size = len(value.encode('utf-8'))
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO results (key, value, size, last_access) '
+                                    'VALUES (?, ?, ?, ?)', (key, value, size, time.time()))
+            self._puts += 1
+            if self._puts % self.EVICTION_CHECK_PERIOD == 0:
+                self.evict()
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        self.connection.execute('BEGIN IMMEDIATE')  # lock for writing, other processes are waiting
+        try:
+            total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total_size > self.max_size:
+                rows = self.connection.execute('SELECT key, size FROM results ORDER BY last_access').fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total_size <= self.max_size:
+                        break
+                    evicted.append((key,))
+                    total_size -= size
+                self.connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+
+    def report(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests if requests > 0 else 0.0
+        return f'cache: hits={self.hits}; misses={self.misses}; hit rate={hit_rate:.1%}'
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
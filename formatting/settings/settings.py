@@ -1,12 +1,83 @@
 from pydantic import BaseModel
 import pydantic_core
+import os
 from pydantic import BaseModel
+from typing import List
+
+
+# settings are found regardless of the working directory
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_PATH = os.path.join(SERVICE_DIR, 'settings', 'settings.json')
+
+
+def service_path(path: str) -> str:
+    # relative path is resolved against the working directory first, then against the service directory
+    if not path or os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(SERVICE_DIR, path)
 
 
 class PipelineSettings(BaseModel):
     use_pipeline: bool
     broker_host: str
     broker_port: int
+    prefetch_count: int
+    in_flight: int
+    heartbeat: int
+
+
+class CacheSettings(BaseModel):
+    use_cache: bool
+    cache_path: str
+    max_size_mb: int
+
+
+class BackendSettings(BaseModel):
+    backend: str
+    batch_size: int
+    api_url: str
+    api_key: str
+    max_in_flight: int
+    stub_latency_ms: float
+    stub_ms_per_token: float
+
+
+class PrefilterSettings(BaseModel):
+    use_prefilter: bool
+    allowed_languages: List[str]
+    lang_model_path: str
+    drop_max_letters_ratio: float
+    short_line_length: int
+    min_list_lines: int
+    drop_min_short_lines_share: float
+    pass_min_letters_ratio: float
+    pass_min_mean_line_length: float
+    pass_max_short_lines_share: float
+    pass_max_markup_artifacts: int
+
+
+class GuardSettings(BaseModel):
+    use_guard: bool
+    ngram_size: int
+    window: int
+    max_repeat_ratio: float
+
+
+class IncrementalSettings(BaseModel):
+    incremental: bool
+    manifest_path: str
+    sniff_workers: int
+
+
+class RetrySettings(BaseModel):
+    max_retries: int
+    base_delay_ms: int
+    max_delay_ms: int
+
+
+class TracingSettings(BaseModel):
+    use_tracing: bool
+    trace_log: str
 
 
 class Settings(BaseModel):
@@ -16,11 +87,24 @@ class Settings(BaseModel):
     dir_path: str
     chunk_size: int
     prompt_file: str
+    output_mode: str
+    edit_prompt_file: str
+    enable_prefix_caching: bool
+    cache_settings: CacheSettings
+    backend_settings: BackendSettings
+    prefilter_settings: PrefilterSettings
+    guard_settings: GuardSettings
+    incremental_settings: IncrementalSettings
     pipeline_settings: PipelineSettings
+    retry_settings: RetrySettings
+    tracing_settings: TracingSettings
     
 
 
-with open('settings/settings.json', encoding='utf-8') as f:
+with open(SETTINGS_PATH, encoding='utf-8') as f:
     json_data = f.read()
 
-formatter_settings = Settings.model_validate(pydantic_core.from_json(json_data))
\ No newline at end of file
+formatter_settings = Settings.model_validate(pydantic_core.from_json(json_data))
+# prompts are shipped with the service
+formatter_settings.prompt_file = service_path(formatter_settings.prompt_file)
+formatter_settings.edit_prompt_file = service_path(formatter_settings.edit_prompt_file)
\ No newline at end of file
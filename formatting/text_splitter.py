@@ -0,0 +1,98 @@
+from typing import List
+
+
+SENTENCE_ENDS = {'.', '!', '?', '…', ';'}
+
+# boundary ranks, the higher the better place to cut the text
+HARD_CUT = 0
+SPACE_CUT = 1
+SENTENCE_CUT = 2
+PARAGRAPH_CUT = 3
+
+
+class TextChunk:
+    def __init__(self, text: str, n_tokens: int, start: int, end: int):
+        self.text = text
+        self.n_tokens = n_tokens  # real count of model tokens in chunk
+        self.start = start      # char offsets of the chunk in source text
+        self.end = end
+
+
+def _boundary_rank(data: str, pos: int) -> int:
+    # rank of the cut before char position pos
+    if pos <= 0 or pos >= len(data):
+        return HARD_CUT
+    prev_char = data[pos - 1]
+    if prev_char == '\n' and (data[pos] == '\n' or data[pos - 2: pos] == '\n\n'):
+        return PARAGRAPH_CUT
+    if prev_char.isspace() or data[pos].isspace():
+        # look to the last non space symbol before cut
+        idx = pos - 1
+        while idx > 0 and data[idx].isspace():
+            idx -= 1
+        if data[idx] in SENTENCE_ENDS:
+            return SENTENCE_CUT
+        return SPACE_CUT
+    return HARD_CUT
+
+
+def split_on_chunks(data: str, tokenizer, chunk_size: int) -> List[TextChunk]:
+    """
+    Splits text on chunks with at most chunk_size model tokens each (token budget).
+    Text is tokenized once, then tokens are passed forward remembering the best cut positions:
+    paragraph end > sentence end > space. The cut is placed on the best boundary which fills
+    at least a half of the budget, text without spaces is cut on token boundaries.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f'chunk size should be positive, got {chunk_size}')
+    if data == "":
+        return []
+    encoding = tokenizer(data, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = encoding['offset_mapping']
+    n_tokens = len(offsets)
+    min_fill = max(chunk_size // 2, 1)
+    chunks = []
+    st_token = 0
+    st_char = 0
+
+    while st_token < n_tokens:
+        if n_tokens - st_token <= chunk_size:
+            chunks.append(TextChunk(data[st_char:], n_tokens - st_token, st_char, len(data)))
+            break
+        # best cut (token idx) for each boundary rank, found in [st_token + min_fill, st_token + chunk_size]
+        best_cuts = {}
+        first_space_cut = None
+        limit = st_token + chunk_size
+
+        for token_idx in range(st_token + 1, limit + 1):
+            pos = offsets[token_idx][0]
+            if pos < offsets[token_idx - 1][1]:
+                continue    # token shares a symbol with the previous one (byte-level tokens)
+            rank = _boundary_rank(data, pos)
+            if token_idx - st_token >= min_fill:
+                best_cuts[rank] = token_idx
+            elif rank >= SPACE_CUT:
+                first_space_cut = token_idx
+        end_token = None
+        for rank in (PARAGRAPH_CUT, SENTENCE_CUT, SPACE_CUT):
+            if rank in best_cuts:
+                end_token = best_cuts[rank]
+                break
+        if end_token is None:
+            end_token = first_space_cut
+        if end_token is None:
+            end_token = best_cuts.get(HARD_CUT)
+        if end_token is None:
+            # no clean token boundary in budget, move forward to the nearest one
+            end_token = limit + 1
+            while end_token < n_tokens and offsets[end_token][0] < offsets[end_token - 1][1]:
+                end_token += 1
+            if end_token >= n_tokens:
+                chunks.append(TextChunk(data[st_char:], n_tokens - st_token, st_char, len(data)))
+                break
+        end_char = offsets[end_token][0]
+        chunks.append(TextChunk(data[st_char:end_char], end_token - st_token, st_char, end_char))
+        st_token = end_token
+        st_char = end_char
+
+    return chunks
@@ -0,0 +1,45 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+
+TRACE_ID_HEADER = 'x-trace-id'
+TRACE_HEADER = 'x-trace'    # event name -> unix timestamp in ms, events of all passed stages
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def now() -> int:
+    # wall clock, so timestamps of different processes can be compared; int ms, pika can't encode floats in headers
+    return int(time.time() * 1000)
+
+
+def trace_headers(trace_id: str, trace: dict) -> dict:
+    return {TRACE_ID_HEADER: trace_id, TRACE_HEADER: trace}
+
+
+class TraceLog:
+    """
+    Local log of the stage events: one jsonl record per document with events added by this stage.
+    Records of all stages are joined by trace id in test/trace_report.py.
+    """
+    def __init__(self, log_path: str, stage: str):
+        log_dir = os.path.dirname(log_path)
+        if log_dir and not os.path.isdir(log_dir):
+            os.makedirs(log_dir, exist_ok=True)
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.file = open(log_path, 'a', encoding='utf-8')
+
+    def write(self, trace_id: str, file_path: str, events: dict, retries: int = 0):
+        record = {'trace_id': trace_id, 'stage': self.stage, 'file': file_path, 'events': events, 'retries': retries}
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import os
+import queue
+import shlex
+import sys
+import time
+import traceback
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGE_DIRS = {'crawler': 'scrapping', 'formatter': 'formatting', 'chunker': 'chunking'}
+STOP = None     # end of the documents stream
+
+
+def enter_stage_dir(stage: str):
+    # every service has its own settings, broker and manifest modules, so each stage runs in its own process
+    # with the service directory as working directory (as in its container)
+    stage_dir = os.path.join(ROOT_DIR, STAGE_DIRS[stage])
+    os.chdir(stage_dir)
+    sys.path.insert(0, stage_dir)
+
+
+class StageStats:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.documents = 0
+        self.errors = 0
+        self.busy_time = 0.0    # document processing
+        self.wait_time = 0.0    # waiting for input or for free place in the output queue (backpressure)
+        self.start_time = time.perf_counter()
+
+    def get_dict(self) -> dict:
+        return {'stage': self.stage, 'documents': self.documents, 'errors': self.errors,
+                'busy_time': self.busy_time, 'wait_time': self.wait_time,
+                'wall_time': time.perf_counter() - self.start_time}
+
+
+def put_document(out_queue, item, stats: StageStats):
+    start_time = time.perf_counter()
+    out_queue.put(item)
+    stats.wait_time += time.perf_counter() - start_time
+
+
+def get_document(in_queue, stats: StageStats):
+    start_time = time.perf_counter()
+    item = in_queue.get()
+    stats.wait_time += time.perf_counter() - start_time
+    return item
+
+
+def crawl_stage(argv, out_queue, stats_queue):
+    enter_stage_dir('crawler')
+    crawler = importlib.import_module('main')
+    args = crawler.create_parser().parse_args(argv)
+    args.use_pipeline = False
+    crawler.validate_args(args)
+    stats = StageStats('crawler')
+
+    def document_sink(file_path: str, text: str):
+        stats.documents += 1
+        put_document(out_queue, (file_path, text), stats)
+    try:
+        urls_extractor = crawler.create_extractor(args, document_sink=document_sink)
+        start_time = time.perf_counter()
+        asyncio.run(urls_extractor.extract(args.base_url, log=args.log))
+        urls_extractor.save_meta_dict()
+        stats.busy_time = time.perf_counter() - start_time - stats.wait_time
+    finally:
+        out_queue.put(STOP)
+        stats_queue.put(stats.get_dict())
+
+
+def format_stage(argv, in_queue, out_queue, stats_queue):
+    enter_stage_dir('formatter')
+    formatter = importlib.import_module('qwen_vllm_doc_filter_chat')
+    args = formatter.create_parser().parse_args(argv)
+    args.use_pipeline = True    # documents are received from the crawler stage, input dir isn't needed
+    os.makedirs(args.output, exist_ok=True)
+    # arguments are validated before the model is loaded
+    formatter.validate_args(args)
+    stats = StageStats('formatter')
+
+    try:
+        backend, tokenizer, chat_prompt, edit_prompt = formatter.load_model(args)
+        cache = formatter.create_cache(args)
+        prefilter = formatter.create_prefilter()
+        batch_size = formatter.get_backend_settings(args).batch_size
+
+        while True:
+            item = get_document(in_queue, stats)
+            if item is STOP:
+                break
+            file_path, text = item
+            output = os.path.abspath(os.path.join(args.output, os.path.basename(file_path)))
+            start_time = time.perf_counter()
+            try:
+                formatted_text = formatter.refactor_doc(file_path, chat_prompt, output, backend, tokenizer,
+                                                        args.chunk_size, cache=cache, batch_size=batch_size,
+                                                        prefilter=prefilter, edit_prompt=edit_prompt, data=text,
+                                                        return_text=True)
+            except Exception as e:
+                stats.errors += 1
+                print(f'formatter exception {str(e)}; for document - {file_path}', file=sys.stderr)
+                continue
+            finally:
+                stats.busy_time += time.perf_counter() - start_time
+            stats.documents += 1
+            put_document(out_queue, (output, formatted_text), stats)
+        backend.close()
+    finally:
+        out_queue.put(STOP)
+        stats_queue.put(stats.get_dict())
+
+
+def chunk_stage(argv, in_queue, stats_queue):
+    enter_stage_dir('chunker')
+    chunking = importlib.import_module('smart_chunking')
+    args = chunking.create_parser().parse_args(argv)
+    args.use_pipeline = False
+    chunking.validate_args(args)
+    stats = StageStats('chunker')
+
+    try:
+        chunker = chunking.create_chunker(args, chunking.chunker_settings)
+        saver = chunking.create_saver(args, chunker)
+
+        while True:
+            item = get_document(in_queue, stats)
+            if item is STOP:
+                break
+            file_path, text = item
+            start_time = time.perf_counter()
+            try:
+                chunking.chunk(file_path, saver, chunker, data=text)
+                stats.documents += 1
+            except Exception as e:
+                stats.errors += 1
+                print(f'chunker exception {str(e)}; for document - {file_path}', file=sys.stderr)
+            stats.busy_time += time.perf_counter() - start_time
+    finally:
+        stats_queue.put(stats.get_dict())
+
+
+def run_stage(target, *args):
+    try:
+        target(*args)
+    except BaseException:
+        traceback.print_exc()
+        sys.exit(1)
+
+
+def print_report(stages_stats: list, wall_time: float):
+    print('STAT:')
+    for stats in stages_stats:
+        print(f'{stats["stage"]}: documents={stats["documents"]}; errors={stats["errors"]}; '
+              f'busy={stats["busy_time"]:.1f}s; waiting={stats["wait_time"]:.1f}s; wall={stats["wall_time"]:.1f}s')
+    chunked = sum(stats['documents'] for stats in stages_stats if stats['stage'] == 'chunker')
+    print(f'pipeline: documents={chunked}; time={wall_time:.1f}s; {chunked / max(wall_time, 1e-9):.2f} docs/sec')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run crawl -> format -> chunk pipeline on one machine without '
+                                                 'message broker, documents are passed between stage processes '
+                                                 'through bounded in-memory queues')
+    parser.add_argument('--crawler_args', type=str, required=False, default='',
+                        help="arguments of the crawler (scrapping/main.py), e.g. \"--base_url=https://www.nsu.ru/n/\"")
+    parser.add_argument('--formatter_args', type=str, required=False, default='',
+                        help='arguments of the formatter (formatting/qwen_vllm_doc_filter_chat.py)')
+    parser.add_argument('--chunker_args', type=str, required=False, default='',
+                        help='arguments of the chunker (chunking/smart_chunking.py)')
+    parser.add_argument('--queue_size', type=int, required=False, default=8,
+                        help='maximum count of documents waiting between stages, the faster stage is blocked '
+                             'when the queue is full')
+    try:
+        args = parser.parse_args()
+        if args.queue_size < 1:
+            raise Exception(f'invalid queue_size={args.queue_size}, should be a positive value')
+    except Exception as e:
+        print('Parse args exception: ' + repr(e), file=sys.stderr)
+        parser.print_help()
+        return
+    context = multiprocessing.get_context('spawn')
+    crawled_queue = context.Queue(maxsize=args.queue_size)
+    formatted_queue = context.Queue(maxsize=args.queue_size)
+    stats_queue = context.Queue()
+    processes = [
+        context.Process(target=run_stage, args=(crawl_stage, shlex.split(args.crawler_args), crawled_queue,
+                                                stats_queue)),
+        context.Process(target=run_stage, args=(format_stage, shlex.split(args.formatter_args), crawled_queue,
+                                                formatted_queue, stats_queue)),
+        context.Process(target=run_stage, args=(chunk_stage, shlex.split(args.chunker_args), formatted_queue,
+                                                stats_queue)),
+    ]
+    start_time = time.perf_counter()
+    for process in processes:
+        process.start()
+    failed = False
+
+    # if some stage fails, the previous ones would be blocked on the full queue, so the pipeline is stopped
+    while not failed and any(process.is_alive() for process in processes):
+        for process in processes:
+            process.join(timeout=1)
+            if process.exitcode is not None and process.exitcode != 0:
+                failed = True
+                break
+    if failed:
+        print('pipeline stage is failed, stop the pipeline', file=sys.stderr)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    for process in processes:
+        process.join()
+    stages_stats = []
+    while True:
+        try:
+            stages_stats.append(stats_queue.get(timeout=1))
+        except queue.Empty:
+            break
+    print_report(stages_stats, time.perf_counter() - start_time)
+
+
+if __name__ == '__main__':
+    main()
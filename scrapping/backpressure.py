@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Callable
+
+
+class QueueBackpressure:
+    """
+    Pauses crawling while downstream stages are behind: if depth of the watched queues reaches high watermark,
+    the crawler waits until it falls to low watermark. Depth is polled every poll_interval seconds.
+    """
+    def __init__(self, get_depth: Callable[[], int], high_watermark: int, low_watermark: int,
+                 poll_interval: float = 5.0, idle_callback: Callable[[], None] = None, log: bool = False):
+        if low_watermark > high_watermark:
+            raise ValueError(f'low watermark={low_watermark} is greater than high watermark={high_watermark}')
+        self.get_depth = get_depth
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.poll_interval = poll_interval
+        self.idle_callback = idle_callback  # keeps broker connection alive during the pause
+        self.log = log
+
+        self.pauses = 0
+        self.paused_time = 0.0
+        self.max_depth = 0
+
+    def _depth(self) -> int:
+        depth = self.get_depth()
+        self.max_depth = max(self.max_depth, depth)
+        return depth
+
+    async def wait(self):
+        depth = self._depth()
+        if depth < self.high_watermark:
+            return
+        self.pauses += 1
+        start_time = time.perf_counter()
+        if self.log:
+            print(f'downstream queue depth={depth}, crawling is paused until {self.low_watermark}')
+
+        while depth > self.low_watermark:
+            await asyncio.sleep(self.poll_interval)
+            if self.idle_callback is not None:
+                self.idle_callback()
+            depth = self._depth()
+        self.paused_time += time.perf_counter() - start_time
+        if self.log:
+            print(f'downstream queue depth={depth}, crawling is resumed')
+
+    def report(self) -> str:
+        return f'backpressure: high watermark={self.high_watermark}; low watermark={self.low_watermark}; ' \
+               f'pauses={self.pauses}; paused time={self.paused_time:.1f}s; max queue depth={self.max_depth}'
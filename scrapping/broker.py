@@ -1,5 +1,6 @@
 import pika
 import os
+from typing import List
 
 
 class BrokerAdapter:
@@ -18,12 +19,30 @@ class BrokerAdapter:
         self.channel.queue_declare(queue=self.queue_name)
         self.init = True
 
-    def push_message(self, message: str):
+    def push_message(self, message: str, headers: dict = None):
         if not self.pipeline_mode:
             return
         if not self.init:
             raise Exception('Broker Adapter is not initialized')
-        self.channel.basic_publish(exchange='', routing_key=self.queue_name, body=message)
+        self.channel.basic_publish(exchange='', routing_key=self.queue_name, body=message,
+                                   properties=pika.BasicProperties(headers=headers))
+
+    def get_queue_depth(self, queue_names: List[str]) -> int:
+        # count of ready messages in the queues, got with passive declare (queue isn't created)
+        if not self.init:
+            raise Exception('Broker Adapter is not initialized')
+        depth = 0
+        for queue_name in queue_names:
+            try:
+                depth += self.channel.queue_declare(queue=queue_name, passive=True).method.message_count
+            except pika.exceptions.ChannelClosedByBroker:
+                self.channel = self.connection.channel()    # queue doesn't exist yet, channel is closed by broker
+        return depth
+
+    def process_events(self):
+        # blocking connection sends heartbeats only while it processes events
+        if self.init:
+            self.connection.process_data_events(time_limit=0)
 
     def close(self):
         if not self.pipeline_mode:
@@ -0,0 +1,100 @@
+import re
+from urllib.parse import urlsplit, parse_qsl
+
+
+ADMIT = 'admit'
+DEPRIORITIZE = 'deprioritize'
+BLOCK = 'block'
+
+ID_SEGMENT_PATTERN = re.compile(r'^(?=.*\d)[0-9a-f-]{8,}$|^(?=.*\d)(?=.*[a-z])[0-9a-z_-]{16,}$', re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r'\d+')
+
+
+def normalize_segment(segment: str) -> str:
+    if ID_SEGMENT_PATTERN.match(segment):
+        return '{id}'   # hashes, uuids, session ids
+    return NUMBER_PATTERN.sub('{n}', segment)   # pages, dates, item numbers
+
+
+def url_pattern(url: str) -> str:
+    # urls which differ only in numbers, ids and query values share the pattern
+    parts = urlsplit(url)
+    path = parts.path.split(';')[0]     # path parameters (;jsessionid=...)
+    segments = [normalize_segment(segment) for segment in path.split('/')]
+    keys = sorted({key for key, _ in parse_qsl(parts.query, keep_blank_values=True)})
+    return parts.netloc.lower() + '/'.join(segments) + ('?' + '&'.join(keys) if keys else '')
+
+
+class PatternStats:
+    def __init__(self):
+        self.urls = 0   # admitted urls
+        self.pages = 0  # fetched pages
+        self.text_pages = 0     # fetched pages with text, only they are probed for new text
+        self.text_size = 0
+        self.new_text_size = 0  # text of lines which weren't seen on previous pages
+        self.exhausted = False  # url budget is spent: new urls are dropped, already admitted ones are kept
+        self.blocked = False    # pages add no new text: queued urls are dropped too
+
+
+class CrawlTrapDetector:
+    """
+    Calendars, endless pagination, faceted search and session ids produce unlimited unique urls with
+    the same pattern. Discovered urls are grouped by pattern (numbers, ids and query values are dropped),
+    every pattern has a budget of urls: after deprioritize_after urls its new urls go to the end of the
+    frontier, after max_urls_per_pattern urls they are dropped. Pattern is blocked (its queued urls are
+    skipped as well) if its first probe_pages pages with text add less than min_new_text_ratio of new text.
+    Without page texts (probe_text=False, e.g. only_urls mode) only the url budget is applied.
+    """
+    def __init__(self, settings, probe_text: bool = True):
+        self.settings = settings
+        self.probe_text = probe_text
+        self.patterns = dict()  # pattern -> PatternStats
+        self.seen_lines = set()     # hashes of lines of all fetched pages
+        self.dropped_urls = 0
+
+    def admit(self, url: str) -> str:
+        # decision for the discovered url: ADMIT, DEPRIORITIZE or BLOCK
+        stats = self.patterns.setdefault(url_pattern(url), PatternStats())
+        if stats.urls >= self.settings.max_urls_per_pattern:
+            stats.exhausted = True
+        if stats.blocked or stats.exhausted:
+            self.dropped_urls += 1
+            return BLOCK
+        stats.urls += 1
+        return DEPRIORITIZE if stats.urls > self.settings.deprioritize_after else ADMIT
+
+    def is_blocked(self, url: str) -> bool:
+        # url could be admitted before its pattern is blocked
+        stats = self.patterns.get(url_pattern(url))
+        return stats is not None and stats.blocked
+
+    def record_page(self, url: str, text: str):
+        stats = self.patterns.setdefault(url_pattern(url), PatternStats())
+        stats.pages += 1
+        if not self.probe_text or text.strip() == '':
+            return  # page without text (not extracted, pdf, empty page) can't show that the pattern is a trap
+        stats.text_pages += 1
+        for line in text.splitlines():
+            line = line.strip()
+            if line == '':
+                continue
+            stats.text_size += len(line)
+            line_hash = hash(line)
+            if line_hash not in self.seen_lines:
+                self.seen_lines.add(line_hash)
+                stats.new_text_size += len(line)
+        if stats.text_pages >= self.settings.probe_pages and \
+                stats.new_text_size < self.settings.min_new_text_ratio * max(stats.text_size, 1):
+            stats.blocked = True    # pages of the pattern are templates without new content
+
+    def report(self) -> str:
+        limited = [(pattern, stats) for pattern, stats in self.patterns.items() if stats.blocked or stats.exhausted]
+        result = f'crawl traps: patterns={len(self.patterns)}; ' \
+                 f'blocked patterns={sum(stats.blocked for _, stats in limited)}; ' \
+                 f'exhausted patterns={sum(stats.exhausted for _, stats in limited)}; dropped urls={self.dropped_urls}'
+        for pattern, stats in sorted(limited, key=lambda item: -item[1].urls):
+            new_text_ratio = stats.new_text_size / max(stats.text_size, 1)
+            state = 'blocked' if stats.blocked else 'exhausted'
+            result += f'\n    {pattern} ({state}): urls={stats.urls}; pages={stats.pages}; ' \
+                      f'new text={new_text_ratio:.1%}'
+        return result
@@ -13,11 +13,12 @@ class DocContentExtractorException(Exception):
 
 
 class DocContentExtractor():
-    def __init__(self, save_dir: str = None, min_content_size: int=50):
+    def __init__(self, save_dir: str = None, min_content_size: int=50, quality_gate=None):
         self.load_timeout = 30
         self.http_client = None
         self.save_dir = "data" if save_dir is None else save_dir
         self.min_content_size = min_content_size
+        self.quality_gate = quality_gate    # DocumentQualityGate, rejected documents aren't saved
 
     async def _init_client(self):
         if self.http_client is None:
@@ -41,7 +42,9 @@ class DocContentExtractor():
                 continue
         f_name = create_url_file_name(url)
 
-        if len(content.strip()) >= self.min_content_size:
+        if len(content.strip()) < self.min_content_size:
+            return
+        if self.quality_gate is None or self.quality_gate.check(content) is None:
             with open(os.path.join(self.save_dir, f_name), 'w', encoding='utf-8') as f:
                 f.write(content.strip())
 
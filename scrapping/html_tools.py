@@ -86,13 +86,31 @@ def drop_html_artifacts(text: str):
 
 
 class HtmlScrapper:
-    def __init__(self, base_url: str, input_url_name: str=None, log: bool=True, only_urls:bool=False):
+    def __init__(self, base_url: str, input_url_name: str=None, log: bool=True, only_urls:bool=False,
+                 max_redirects: int=1):
         self.url = base_url
         self.http_client = httpx.AsyncClient(timeout=30)
         self.log = log
         self.init = False
         self.input_url_name = input_url_name
         self.only_urls = only_urls
+        self.max_redirects = max_redirects
+        self.redirect_chain = [base_url]    # requested url and redirect targets, the last one is loaded
+        self.canonical_url = None   # <link rel="canonical"> of the page
+
+    @property
+    def final_url(self) -> str:
+        return self.redirect_chain[-1]
+
+    def _find_canonical_url(self, soup: BeautifulSoup):
+        link = soup.find('link', rel='canonical')
+        if link is None or not link.get('href'):
+            return None
+        canonical_url = unquote(try_join_url(self.final_url, link.get('href').strip()))
+        # canonical url on another host is ignored, so the page can't move crawling out of the site
+        if urlparse(canonical_url).netloc != urlparse(self.final_url).netloc:
+            return None
+        return canonical_url
 
     # loads html for self.url and init body
     async def init_scrapper(self):
@@ -100,8 +118,13 @@ class HtmlScrapper:
         # extract html body in constructor:
         try:
             response = await self.http_client.get(self.url)
-            if response.status_code in redirects:
-                redirected_url = response.headers['Location']
+            while response.status_code in redirects:
+                if len(self.redirect_chain) > self.max_redirects:
+                    raise Exception(f'more than {self.max_redirects} redirects')
+                redirected_url = unquote(try_join_url(self.final_url, response.headers['Location']))
+                if redirected_url in self.redirect_chain:
+                    raise Exception(f'redirect loop to {redirected_url}')
+                self.redirect_chain.append(redirected_url)
                 response = await self.http_client.get(redirected_url)
             response.raise_for_status()
         except httpx.HTTPStatusError as e:
@@ -121,6 +144,7 @@ class HtmlScrapper:
             raise exception
         try:
             soup = BeautifulSoup(response.text, 'html.parser')
+            self.canonical_url = self._find_canonical_url(soup)
             self.body = soup.find('body')
             if self.body is None:
                 raise Exception('empty body in html document')
@@ -147,7 +171,8 @@ class HtmlScrapper:
 
         urls = self.body.find_all('a')
         urls = drop_empty_links(urls)
-        child_urls_data = [get_url_data(url_tag, self.url) for url_tag in urls]
+        # relative refs are resolved against the loaded page url, not the requested one
+        child_urls_data = [get_url_data(url_tag, self.final_url) for url_tag in urls]
         child_urls = [data[0] for data in child_urls_data]
         names = [data[1] for data in child_urls_data]
         names_dict = {url: name for url, name in zip(child_urls, names)}
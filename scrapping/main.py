@@ -36,7 +36,7 @@ def parse_bool_str(arg:str):
         raise argparse.ArgumentTypeError(f'invalid bool literal: {arg}')
 
 
-async def main():
+def create_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--base_url', type=str, default=crawler_settings.launch.base_url,
                         help='base url to start extracting content from')
@@ -64,6 +64,27 @@ async def main():
                         help="urls without containing any of this domens will be ignored.")
     parser.add_argument('--use_pipeline', type=parse_bool_str, default=crawler_settings.pipeline_settings.use_pipeline,
                         help='weather to use pipeline mode with message broker or not')
+    return parser
+
+
+def create_extractor(args, document_sink=None):
+    ignored_domens = crawler_settings.ignored_domens
+    required_domens = args.required_domens
+    exclude_files = get_excluded_files(args.exclude_dirs)
+    return UrlExtractor(settings=crawler_settings,
+                        max_depth=args.depth,
+                        ignored_domens=list(ignored_domens),
+                        required_domens=required_domens,
+                        max_urls=args.max_urls,
+                        exclude_files=exclude_files,
+                        save_dir=args.output,
+                        use_pipeline=args.use_pipeline,
+                        document_sink=document_sink
+                        )
+
+
+async def main():
+    parser = create_parser()
     try:
         args = parser.parse_args()
         validate_args(args)
@@ -71,20 +92,10 @@ async def main():
         print('Parse args exception: ' + repr(e), file=sys.stderr)
         parser.print_help()
         return
-    ignored_domens = crawler_settings.ignored_domens
-    required_domens = args.required_domens
-    exclude_files = get_excluded_files(args.exclude_dirs)
-    urls_extractor = UrlExtractor(settings=crawler_settings,
-                                  max_depth=args.depth,
-                                  ignored_domens=list(ignored_domens),
-                                  required_domens=required_domens,
-                                  max_urls=args.max_urls,
-                                  exclude_files=exclude_files,
-                                  save_dir=args.output,
-                                  use_pipeline=args.use_pipeline
-                                  )
+    urls_extractor = create_extractor(args)
     await urls_extractor.extract(args.base_url, log=args.log)
     urls_extractor.save_meta_dict()   # save dict with <file_name: url> pairs
+    print(urls_extractor.get_stats())
 
 
 if __name__ == '__main__':
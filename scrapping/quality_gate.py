@@ -0,0 +1,78 @@
+import re
+import threading
+from collections import Counter
+from language_id import LanguageDetector
+
+
+# reject reasons
+LANGUAGE = 'language'
+LETTERS = 'letters'     # mostly digits, symbols or markup
+SENTENCE_LENGTH = 'sentence_length'     # link lists and menus (too short), text without punctuation (too long)
+DUPLICATED_LINES = 'duplicated_lines'   # repeated blocks and templates
+ERROR_PAGE = 'error_page'   # error page returned with 200 status
+REASONS = [LANGUAGE, LETTERS, SENTENCE_LENGTH, DUPLICATED_LINES, ERROR_PAGE]
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?…]+\s+|\n+')
+ERROR_PAGE_PATTERN = re.compile(r'(?:error|ошибка)\s*404|404\s*(?:not found|error)|page not found|'
+                                r'page (?:does not|doesn\'t) exist|access denied|страница не найдена|'
+                                r'доступ запрещ[её]н', re.IGNORECASE)
+ERROR_PAGE_LENGTH = 1000    # only short document with error pattern is treated as error page
+
+
+class DocumentFeatures:
+    def __init__(self, text: str):
+        non_space = [c for c in text if not c.isspace()]
+        letters = [c for c in non_space if c.isalpha()]
+        self.letters_ratio = len(letters) / max(len(non_space), 1)
+
+        sentences = [sentence for sentence in SENTENCE_END_PATTERN.split(text) if sentence.strip() != '']
+        self.mean_sentence_words = sum(len(sentence.split()) for sentence in sentences) / max(len(sentences), 1)
+
+        lines = [line.strip() for line in text.splitlines() if line.strip() != '']
+        lines_counts = Counter(lines)
+        # every occurrence of a repeated line after the first one is a duplicate
+        self.duplicated_lines_share = sum(count - 1 for count in lines_counts.values()) / max(len(lines), 1)
+        self.length = len(text.strip())
+
+
+class DocumentQualityGate:
+    """
+    Cheap checks of the extracted page before it's saved and published: language id, letters ratio,
+    mean sentence length, share of duplicated lines and error page patterns. Rejected documents don't
+    reach the formatter, so GPU time isn't spent on them.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.language_detector = LanguageDetector(settings.lang_model_path)
+        self.lock = threading.Lock()    # pdf documents are checked in threads
+        self.passed = 0
+        self.rejected = {reason: 0 for reason in REASONS}
+
+    def _check(self, text: str):
+        settings = self.settings
+        features = DocumentFeatures(text)
+        if features.letters_ratio < settings.min_letters_ratio:
+            return LETTERS
+        if features.length < ERROR_PAGE_LENGTH and ERROR_PAGE_PATTERN.search(text) is not None:
+            return ERROR_PAGE
+        if settings.allowed_languages and self.language_detector.detect(text) not in settings.allowed_languages:
+            return LANGUAGE
+        if not settings.min_mean_sentence_words <= features.mean_sentence_words <= settings.max_mean_sentence_words:
+            return SENTENCE_LENGTH
+        if features.duplicated_lines_share > settings.max_duplicated_lines_share:
+            return DUPLICATED_LINES
+        return None
+
+    def check(self, text: str):
+        # returns reject reason or None if document passes
+        reason = self._check(text)
+        with self.lock:
+            if reason is None:
+                self.passed += 1
+            else:
+                self.rejected[reason] += 1
+        return reason
+
+    def report(self) -> str:
+        rejected = '; '.join(f'{reason}={count}' for reason, count in self.rejected.items())
+        return f'quality gate: passed={self.passed}; rejected={sum(self.rejected.values())} ({rejected})'
@@ -1,8 +1,15 @@
 from pydantic import BaseModel
 import pydantic_core
 import json
+import os
 from typing import List
 
+
+# settings are found regardless of the working directory
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_PATH = os.path.join(SERVICE_DIR, 'settings', 'settings.json')
+
+
 class LaunchSettings(BaseModel):
     base_url: str
     depth: int
@@ -23,18 +30,61 @@ class PipelineSettings(BaseModel):
     broker_port: int
 
 
+class BackpressureSettings(BaseModel):
+    use_backpressure: bool
+    watched_queues: List[str]
+    high_watermark: int
+    low_watermark: int
+    poll_interval: float
+
+
+class QualitySettings(BaseModel):
+    use_quality_gate: bool
+    allowed_languages: List[str]
+    lang_model_path: str
+    min_letters_ratio: float
+    min_mean_sentence_words: float
+    max_mean_sentence_words: float
+    max_duplicated_lines_share: float
+
+
+class TrapSettings(BaseModel):
+    use_trap_detection: bool
+    deprioritize_after: int
+    max_urls_per_pattern: int
+    probe_pages: int
+    min_new_text_ratio: float
+
+
+class ResolutionSettings(BaseModel):
+    max_redirects: int
+    use_canonical: bool
+
+
+class TracingSettings(BaseModel):
+    use_tracing: bool
+    trace_log: str
+
+
 class Settings(BaseModel):
     urls_policy: UrlPolicy
     reject_http: bool
     load_pdf: bool
     medias: List[str]
     ignored_domens: List[str]
+    required_domens: List[str]
+    exclude_dirs: List[str]
     pipeline_settings: PipelineSettings
+    backpressure_settings: BackpressureSettings
+    tracing_settings: TracingSettings
+    quality_settings: QualitySettings
+    trap_settings: TrapSettings
+    resolution_settings: ResolutionSettings
     min_content_size: int
     launch: LaunchSettings
 
 
-with open('settings/settings.json', encoding='utf-8') as f:
+with open(SETTINGS_PATH, encoding='utf-8') as f:
     json_data = f.read()
 
 
@@ -0,0 +1,48 @@
+from typing import List
+
+
+class UrlResolutionCache:
+    """
+    Remembers redirect chains and rel=canonical targets of fetched pages. Known aliases (short, legacy
+    or tracking urls) are replaced with their final url before they get into the frontier, so they aren't
+    fetched again, and every page is saved once under its canonical url.
+    """
+    def __init__(self):
+        self.aliases = dict()   # alias -> final or canonical url
+        self.fetched = set()    # final urls of fetched pages
+        self.rewrites = 0   # urls replaced with their final url
+        self.duplicates = 0     # fetched pages which final url was already fetched
+
+    def resolve(self, url: str) -> str:
+        seen = set()
+        result = url
+
+        while result in self.aliases and result not in seen:
+            seen.add(result)
+            result = self.aliases[result]
+        if result != url:
+            self.rewrites += 1
+        return result
+
+    def add_resolution(self, redirect_chain: List[str], canonical_url: str = None) -> str:
+        # redirect_chain - requested url and redirect targets, returns the final url of the page
+        target = canonical_url if canonical_url is not None else redirect_chain[-1]
+        for url in redirect_chain:
+            if url != target:
+                self.aliases[url] = target
+        return self.resolve(target)
+
+    def is_fetched(self, url: str) -> bool:
+        return self.resolve(url) in self.fetched
+
+    def mark_fetched(self, url: str) -> bool:
+        # returns False if the page was already fetched under another alias
+        if url in self.fetched:
+            self.duplicates += 1
+            return False
+        self.fetched.add(url)
+        return True
+
+    def report(self) -> str:
+        return f'url resolution: aliases={len(self.aliases)}; rewritten urls={self.rewrites}; ' \
+               f'duplicated pages={self.duplicates}'
@@ -14,6 +14,11 @@ from html_tools import HtmlScrapper, UrlMetaData
 from collections import deque
 from urllib.parse import unquote
 from broker import BrokerAdapter
+from backpressure import QueueBackpressure
+from quality_gate import DocumentQualityGate
+from crawl_traps import CrawlTrapDetector, DEPRIORITIZE, BLOCK
+from url_resolution import UrlResolutionCache
+from tracing import TraceLog, new_trace_id, now, trace_headers
 from html_tools import create_url_file_name
 import json
 
@@ -61,7 +66,7 @@ def remove_ident_urls(url_name_dict: dict):
 class UrlExtractor:
     def __init__(self, settings: Settings, max_depth:int=2, ignored_domens: List[str]=None,
                  required_domens: List[str]=None, max_urls:int=None, exclude_files=None,
-                 save_dir: str=None, use_pipeline:bool=False):
+                 save_dir: str=None, use_pipeline:bool=False, document_sink=None):
         self._max_depth = max_depth
         self._ignored_domens = ignored_domens if ignored_domens is not None else []
         self._required_domens = required_domens if required_domens is not None else []
@@ -81,6 +86,38 @@ class UrlExtractor:
         pipeline_settings = self.settings.pipeline_settings
         self.broker_adapter = BrokerAdapter(pipeline_settings.broker_host, pipeline_settings.broker_port, use_pipeline)
         self.broker_adapter.init_adapter()
+        # blocking callback (file_path, text) which gets saved documents instead of broker (in-process pipeline)
+        self.document_sink = document_sink
+        # crawling is paused while formatter is behind, in-process pipeline is throttled by its bounded queue
+        self.backpressure = None
+        backpressure_settings = self.settings.backpressure_settings
+        if use_pipeline and document_sink is None and backpressure_settings.use_backpressure:
+            self.backpressure = QueueBackpressure(
+                lambda: self.broker_adapter.get_queue_depth(backpressure_settings.watched_queues),
+                backpressure_settings.high_watermark,
+                backpressure_settings.low_watermark,
+                backpressure_settings.poll_interval,
+                idle_callback=self.broker_adapter.process_events)
+
+        # trace id and events timestamps are sent with the message, events are also written to the local log
+        self.trace_log = None
+        if use_pipeline and document_sink is None and self.settings.tracing_settings.use_tracing:
+            self.trace_log = TraceLog(self.settings.tracing_settings.trace_log, 'crawler')
+
+        # low quality documents (other languages, link lists, error pages) are neither saved nor published
+        self.quality_gate = None
+        if self.settings.quality_settings.use_quality_gate:
+            self.quality_gate = DocumentQualityGate(self.settings.quality_settings)
+
+        # url patterns (pagination, calendars, facets) which produce too many urls or no new text are limited
+        self.trap_detector = None
+        if self.settings.trap_settings.use_trap_detection:
+            # only_urls mode doesn't extract text, so only url budgets are applied
+            self.trap_detector = CrawlTrapDetector(self.settings.trap_settings,
+                                                   probe_text=not self.settings.urls_policy.only_urls)
+
+        # redirect chains and canonical urls of fetched pages, shared by all crawls of the extractor
+        self.url_resolver = UrlResolutionCache()
 
         self.urls_cache = set()
         self.meta_dict = dict() # meta info about handled urls
@@ -152,6 +189,32 @@ class UrlExtractor:
                 result.append(task)
         return result
 
+    def passes_quality_gate(self, extracted_text: str, url: str) -> bool:
+        # too short documents aren't saved anyway, so they aren't counted by the gate
+        if self.quality_gate is None or len(extracted_text.strip()) < self.settings.min_content_size:
+            return True
+        reason = self.quality_gate.check(extracted_text.strip())
+        if reason is not None and self.log:
+            print(f'{url} is rejected by quality gate: {reason}')
+        return reason is None
+
+    def register_fetched(self, task_url: str, scrapper: HtmlScrapper):
+        # returns final url of the page or None if the page with the same final url is already fetched
+        canonical_url = scrapper.canonical_url if self.settings.resolution_settings.use_canonical else None
+        url = self.url_resolver.add_resolution([task_url] + scrapper.redirect_chain, canonical_url)
+        return url if self.url_resolver.mark_fetched(url) else None
+
+    def split_by_traps(self, tasks: List[UrlHandleTask]):
+        # returns admitted, deprioritized and blocked tasks
+        if self.trap_detector is None:
+            return tasks, [], []
+        result = {DEPRIORITIZE: [], BLOCK: []}
+        admitted = []
+
+        for task in tasks:
+            result.get(self.trap_detector.admit(task.url), admitted).append(task)
+        return admitted, result[DEPRIORITIZE], result[BLOCK]
+
     async def save_extracted_text(self, extracted_text: str, url):
         # write extracted text to the result file
         res_file_name = create_url_file_name(url)
@@ -162,10 +225,28 @@ class UrlExtractor:
         except Exception as e:
             raise e
 
+    async def push_document(self, file_path: str, text: str = None, trace: dict = None):
+        if self.document_sink is None:
+            headers = None
+            if self.trace_log is not None:
+                trace_id = new_trace_id()
+                trace = dict(trace or {}, published=now())
+                headers = trace_headers(trace_id, trace)
+                self.trace_log.write(trace_id, file_path, trace)
+            self.broker_adapter.push_message(message=file_path, headers=headers)
+            return
+        if text is None:
+            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+                text = await f.read()
+        # sink blocks while the next stage is busy, so it's called in thread to keep other tasks running
+        await asyncio.to_thread(self.document_sink, file_path, text)
+
     # extracts text by url and returns child refs tasks: UrlHandleTask
     async def url_handle_routine(self, task: UrlHandleTask) -> List[UrlHandleTask]:
         if task.depth > self._max_depth or self._is_rejected(task.url) or self.enough_urls():
             return []
+        if self.trap_detector is not None and self.trap_detector.is_blocked(task.url):
+            return []   # pattern was blocked after the url was queued
         format = task.url.split('.')[-1]
         out_file_name = create_url_file_name(task.url)
         full_path = os.path.abspath(os.path.join(self._save_dir, out_file_name))
@@ -176,10 +257,13 @@ class UrlExtractor:
             # documents extracting (pdf):
             if self.settings.load_pdf:
                 try:
+                    trace = dict()
                     # extract document content if only_urls is disabled:
                     if not self.settings.urls_policy.only_urls:
-                        async with DocContentExtractor(save_dir=self._save_dir) as extractor:
+                        async with DocContentExtractor(save_dir=self._save_dir,
+                                                       quality_gate=self.quality_gate) as extractor:
                             await extractor.extract_content(task.url, format)
+                            trace['fetched'] = trace['saved'] = now()   # document is saved by extractor
                             if self.log:
                                 print(f'[{task.depth}] {task.url} is processed')
                     meta = UrlMetaData(task.url)
@@ -188,7 +272,7 @@ class UrlExtractor:
 
                     # push task to broker if file was successfully saved:
                     if os.path.isfile(os.path.join(self._save_dir, out_file_name)) and out_file_name not in self.msg_cache:
-                        self.broker_adapter.push_message(message=broker_task.file_path)
+                        await self.push_document(broker_task.file_path, trace=trace)
                         self.msg_cache.add(out_file_name)
                 except DocContentExtractorException as e:
                     if self.log:
@@ -196,35 +280,59 @@ class UrlExtractor:
             return []   # no child urls for document
         if self._is_media(task.url): # ignore medias (zip, png, jpg ans s.o.)
             return []
+        # known alias is loaded by its final url, alias of already fetched page isn't loaded at all
+        url = self.url_resolver.resolve(task.url)
+        if self.url_resolver.is_fetched(url):
+            return []
         # scrap html (extract content, child refs and ref's names):
-        scrapper = HtmlScrapper(task.url, task.url_name, log=self.log, only_urls=self.settings.urls_policy.only_urls)
+        scrapper = HtmlScrapper(url, task.url_name, log=self.log, only_urls=self.settings.urls_policy.only_urls,
+                                max_redirects=self.settings.resolution_settings.max_redirects)
         try:
             await scrapper.init_scrapper()
+            trace = {'fetched': now()}
+            # page which final url is already fetched (by another alias or the same canonical url) isn't saved
+            # again, but its child urls are followed: sorted listings and pagination share canonical url
+            final_url = self.register_fetched(task.url, scrapper)
+            url = final_url if final_url is not None else scrapper.final_url
             extracted_text = scrapper.extract_text()
+            if self.trap_detector is not None:
+                self.trap_detector.record_page(url, extracted_text)
             urls, urls_names_dict = scrapper.extract_child_urls()
-            meta = scrapper.get_meta()
-            self.meta_dict[task.url] = meta # add meta info for handled url
+            if final_url is not None:
+                meta = scrapper.get_meta()
+                meta['url'] = url
+                self.meta_dict[url] = meta # add meta info for handled url
         except Exception as e:
             if self.log:
                 print("html scrapping error: " + str(e))
-                return []
+            return []
+        # page is saved under its final (canonical) url
+        out_file_name = create_url_file_name(url)
+        broker_task = BrokerTask(os.path.abspath(os.path.join(self._save_dir, out_file_name)))
         # save extracted text to file:
         try:
-            if not self.settings.urls_policy.only_urls:
-                await self.save_extracted_text(extracted_text, task.url)
-                # push task to broker if file was saved:
-                if os.path.isfile(os.path.join(self._save_dir, out_file_name)) and out_file_name not in self.msg_cache:
-                    self.broker_adapter.push_message(message=broker_task.file_path) # TODO: later json should be passed
-                    self.msg_cache.add(out_file_name)
-            self.processed_urls_count += 1   # url was successfully processed
-            if self.log:
-                print(f'[{task.depth}] {task.url} is processed')
+            if final_url is None:
+                if self.log:
+                    print(f'[{task.depth}] {task.url} is already fetched, only its child urls are used')
+            else:
+                if not self.settings.urls_policy.only_urls and self.passes_quality_gate(extracted_text, url):
+                    await self.save_extracted_text(extracted_text, url)
+                    trace['saved'] = now()
+                    # push task to broker if file was saved:
+                    if os.path.isfile(os.path.join(self._save_dir, out_file_name)) and \
+                            out_file_name not in self.msg_cache:
+                        await self.push_document(broker_task.file_path, extracted_text.strip(), trace)
+                        self.msg_cache.add(out_file_name)
+                self.processed_urls_count += 1   # url was successfully processed
+                if self.log:
+                    print(f'[{task.depth}] {task.url} is processed')
         except Exception as e:
             if self.log:
                 print(f"I/O exception, while saving {task.url} content': {str(e)}", file=sys.stderr, flush=True)
-        # filter urls and construct the result
-        child_urls = self.remove_bad_urls(urls)
-        urls_names_dict = remove_ident_urls(urls_names_dict)
+        # filter urls and construct the result, known aliases are replaced with their final urls
+        child_urls = self.remove_bad_urls([self.url_resolver.resolve(remove_ident(url)) for url in urls])
+        urls_names_dict = {self.url_resolver.resolve(url): name
+                           for url, name in remove_ident_urls(urls_names_dict).items()}
         result = []
 
         for child_url in child_urls:
@@ -244,19 +352,24 @@ class UrlExtractor:
 
         self.log = log
         self._urls_count = 0
+        if self.backpressure is not None:
+            self.backpressure.log = log
         base_url = unquote(base_url)
         base_url = self._supplement_base_url(base_url)  # Add https if necessary
 
         urls_queue = deque([UrlHandleTask(base_url, 1, "")])  # Queue with (URL, depth)
+        deferred_queue = deque()    # deprioritized urls of large patterns, processed after the main queue
         self.urls_cache.add(base_url)
 
-        while urls_queue and not self.enough_urls():
+        while (urls_queue or deferred_queue) and not self.enough_urls():
+            if self.backpressure is not None:
+                await self.backpressure.wait()
             # Calculate how many URLs to process in this step
             remaining_count = self._max_urls - self._urls_count
-            batch_size = min(remaining_count, len(urls_queue), self._step)
+            batch_size = min(remaining_count, len(urls_queue) + len(deferred_queue), self._step)
 
             # Get the next batch of URLs and depths to process
-            cur_urls_tasks = [urls_queue.popleft() for _ in range(batch_size)]   # get tasks
+            cur_urls_tasks = [(urls_queue or deferred_queue).popleft() for _ in range(batch_size)]   # get tasks
 
             # Process URLs concurrently
             coros = [self.url_handle_routine(task) for task in cur_urls_tasks]
@@ -267,9 +380,22 @@ class UrlExtractor:
             # drop duplicated tasks (with the same url):
             new_urls_tasks = self.drop_duplicated_tasks(new_urls_tasks)
 
-            # Add new URLs to the queue and url's cache
+            # Add new URLs to the queue and url's cache, blocked urls are cached to not check them again
+            new_urls_tasks, deferred_tasks, blocked_tasks = self.split_by_traps(new_urls_tasks)
             urls_queue += new_urls_tasks
-            self.urls_cache.update(task.url for task in new_urls_tasks)
+            deferred_queue += deferred_tasks
+            self.urls_cache.update(task.url for task in chain(new_urls_tasks, deferred_tasks, blocked_tasks))
+
+    def get_stats(self) -> str:
+        result = f'crawl stats: processed urls={self.processed_urls_count}; published documents={len(self.msg_cache)}'
+        if self.quality_gate is not None:
+            result += '\n' + self.quality_gate.report()
+        if self.trap_detector is not None:
+            result += '\n' + self.trap_detector.report()
+        result += '\n' + self.url_resolver.report()
+        if self.backpressure is not None:
+            result += '\n' + self.backpressure.report()
+        return result
 
     def save_meta_dict(self):
         file_name = self.settings.urls_policy.urls_file_name
@@ -0,0 +1,72 @@
+import pika
+import argparse
+import sys
+
+
+def inspect_messages(channel, dead_queue_name: str, limit: int):
+    # messages are got without ack, so they return to the queue when the connection is closed
+    count = 0
+    while count < limit:
+        method, properties, body = channel.basic_get(queue=dead_queue_name, auto_ack=False)
+        if method is None:
+            break
+        headers = properties.headers or {}
+        print(f'{body.decode()}; retries={headers.get("x-retry-count")}; error={headers.get("x-last-error")}')
+        count += 1
+    print(f'totally inspected={count}')
+
+
+def replay_messages(channel, dead_queue_name: str, queue_name: str, limit: int):
+    # messages are published to the original queue with reset retry count
+    count = 0
+    while count < limit:
+        method, properties, body = channel.basic_get(queue=dead_queue_name, auto_ack=False)
+        if method is None:
+            break
+        # only retry count is reset, trace id and other headers are kept
+        headers = dict(properties.headers or {})
+        headers.pop('x-retry-count', None)
+        channel.basic_publish(exchange='', routing_key=queue_name, body=body,
+                              properties=pika.BasicProperties(headers=headers, delivery_mode=properties.delivery_mode))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        count += 1
+    print(f'totally replayed={count} to {queue_name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='inspect or replay dead-letter queue of the pipeline stage')
+    parser.add_argument('--broker_host', type=str, required=False, default='localhost',
+                        help='hostname of message broker')
+    parser.add_argument('--broker_port', type=int, required=False, default=5672,
+                        help='port where message broker is running')
+    parser.add_argument('--queue_name', type=str, required=True,
+                        help='consume queue of the stage (e.g. scrapper_queue), dead letters are in <queue_name>.dead')
+    parser.add_argument('--action', type=str, required=False, default='inspect', choices=['inspect', 'replay'],
+                        help='inspect - print dead messages, replay - send them back to the queue')
+    parser.add_argument('--limit', type=int, required=False, default=100,
+                        help='maximum count of messages to process')
+    try:
+        args = parser.parse_args()
+        if args.limit <= 0:
+            raise Exception(f'limit must be positive - limit={args.limit}')
+    except Exception as e:
+        print('Parse args exception: ' + repr(e), file=sys.stderr)
+        parser.print_help()
+        return
+    dead_queue_name = f'{args.queue_name}.dead'
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.broker_host, port=args.broker_port))
+    channel = connection.channel()
+    channel.queue_declare(queue=dead_queue_name)
+    try:
+        if args.action == 'inspect':
+            inspect_messages(channel, dead_queue_name, args.limit)
+        else:
+            channel.queue_declare(queue=args.queue_name)
+            replay_messages(channel, dead_queue_name, args.queue_name, args.limit)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+import argparse
+import importlib
+import json
+import os
+import shlex
+import sys
+import threading
+import time
+import uuid
+from trace_report import percentile, PERCENTILES
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# stage -> service directory, script module, consumed queue and the last trace event of the stage
+STAGES = {
+    'formatter': {'dir': 'formatting', 'script': 'qwen_vllm_doc_filter_chat', 'queue': 'scrapper_queue',
+                  'done_event': 'formatted'},
+    'chunker': {'dir': 'chunking', 'script': 'smart_chunking', 'queue': 'formatter_queue',
+                'done_event': 'chunked'},
+}
+LOAD_ID_HEADER = 'x-load-id'
+
+
+class LoadStats:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.queue_name = STAGES[stage]['queue']
+        self.lock = threading.Lock()
+        self.sent = dict()  # load id -> send time
+        self.done = dict()  # load id -> time when processing is finished
+        self.dead = set()   # load ids moved to dead-letter queue
+        self.failing = set()    # load ids which failed attempt is acked now
+        self.errors = 0     # failed attempts
+        self.redeliveries = 0
+        self.produced = 0   # messages published by the stage to the next one
+
+    def finished(self) -> bool:
+        with self.lock:
+            return len(self.done) + len(self.dead) >= len(self.sent)
+
+    def on_broker_event(self, event: str, queue_name: str, message):
+        # listener of the in-memory broker
+        load_id = (message.properties.headers or {}).get(LOAD_ID_HEADER)
+        with self.lock:
+            if event == 'published' and load_id is None:
+                self.produced += 1
+            elif event == 'published' and queue_name.startswith(self.queue_name + '.retry.'):
+                self.errors += 1
+                self.redeliveries += 1
+                self.failing.add(load_id)
+            elif event == 'published' and queue_name == self.queue_name + '.dead':
+                self.errors += 1
+                self.dead.add(load_id)
+                self.failing.add(load_id)
+            elif event == 'requeued' and queue_name == self.queue_name:
+                self.errors += 1
+                self.redeliveries += 1
+            elif event == 'acked' and queue_name == self.queue_name and load_id is not None:
+                if load_id in self.failing:
+                    self.failing.discard(load_id)   # failed message is acked after it's moved to retry queue
+                else:
+                    self.done[load_id] = time.time()
+
+    def on_trace_record(self, record: dict, done_event: str):
+        # record of the stage trace log
+        load_id = record['trace_id']
+        with self.lock:
+            if load_id not in self.sent or load_id in self.done:
+                return
+            done_time = record['events'].get(done_event)     # ms timestamp
+            self.done[load_id] = done_time / 1000 if done_time is not None else time.time()
+            self.redeliveries += record.get('retries', 0)
+            self.errors += record.get('retries', 0)
+
+    def report(self, wall_time: float) -> str:
+        latencies = sorted(self.done[load_id] - self.sent[load_id] for load_id in self.done)
+        result = f'{self.stage}: sent={len(self.sent)}; completed={len(self.done)}; dead={len(self.dead)}; ' \
+                 f'errors={self.errors}; redeliveries={self.redeliveries}; produced={self.produced}\n'
+        if len(self.done) > 0:
+            active_time = max(self.done.values()) - min(self.sent.values())
+            result += f'throughput: {len(self.done) / max(active_time, 1e-9):.2f} docs/sec ' \
+                      f'(wall time {wall_time:.1f}s)\n'
+            result += 'latency: ' + '; '.join(f'p{p}={percentile(latencies, p):.3f}s' for p in PERCENTILES) + \
+                      f'; max={latencies[-1]:.3f}s'
+        return result
+
+
+def get_corpus(corpus_dir: str, count: int):
+    files = sorted(os.path.abspath(os.path.join(corpus_dir, file)) for file in os.listdir(corpus_dir)
+                   if os.path.isfile(os.path.join(corpus_dir, file)))
+    return [files[idx % len(files)] for idx in range(count)]
+
+
+def send_corpus(publish, files, rate: float, stats: LoadStats):
+    # publish(body, headers); rate - messages per second, 0 - as fast as possible
+    start_time = time.perf_counter()
+
+    for idx, file in enumerate(files):
+        if rate > 0:
+            delay = start_time + idx / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        load_id = uuid.uuid4().hex
+        send_time = time.time()
+        with stats.lock:
+            stats.sent[load_id] = send_time
+        # load id is also a trace id, so the stage writes its completion to the trace log
+        publish(file, {LOAD_ID_HEADER: load_id, 'x-trace-id': load_id,
+                       'x-trace': {'published': int(send_time * 1000)}})
+
+
+def wait_finished(stats: LoadStats, timeout: float, poll=None, stage_thread: threading.Thread = None):
+    deadline = time.perf_counter() + timeout
+    while not stats.finished() and time.perf_counter() < deadline:
+        if stage_thread is not None and not stage_thread.is_alive():
+            print('stage is stopped', file=sys.stderr)
+            return
+        if poll is not None:
+            poll()
+        time.sleep(0.1)
+    if not stats.finished():
+        print(f'timeout: {len(stats.sent) - len(stats.done) - len(stats.dead)} messages are not processed',
+              file=sys.stderr)
+
+
+def run_memory(args, files, stats: LoadStats):
+    # the stage runs in this process with in-memory broker instead of RabbitMQ
+    import memory_broker
+    broker = memory_broker.install()
+    broker.listener = stats.on_broker_event
+    stage = STAGES[args.stage]
+    stage_dir = os.path.join(ROOT_DIR, stage['dir'])
+    os.chdir(stage_dir)
+    sys.path.insert(0, stage_dir)
+    module = importlib.import_module(stage['script'])
+    sys.argv = [stage['script'] + '.py', '--use_pipeline', 'true'] + shlex.split(args.stage_args)
+    stage_thread = threading.Thread(target=module.main, daemon=True)
+    stage_thread.start()
+
+    # wait until the model is loaded and consumer is registered, so load time isn't counted in latency
+    while stage['queue'] not in broker.consumed_queues:
+        if not stage_thread.is_alive():
+            raise Exception('stage is stopped before consuming')
+        time.sleep(0.1)
+    connection = memory_broker.BlockingConnection()
+    channel = connection.channel()
+    channel.queue_declare(queue=stage['queue'])
+
+    def publish(body: str, headers: dict):
+        channel.basic_publish(exchange='', routing_key=stage['queue'], body=body,
+                              properties=memory_broker.BasicProperties(headers=headers))
+    start_time = time.perf_counter()
+    send_corpus(publish, files, args.rate, stats)
+    wait_finished(stats, args.timeout, stage_thread=stage_thread)
+    broker.stop()
+    return time.perf_counter() - start_time
+
+
+def run_rabbitmq(args, files, stats: LoadStats):
+    # the stage is running separately (e.g. in container) with tracing enabled, its completions are read
+    # from its trace log
+    import pika
+    stage = STAGES[args.stage]
+    connection = pika.BlockingConnection(pika.ConnectionParameters(host=args.broker_host, port=args.broker_port))
+    channel = connection.channel()
+    channel.queue_declare(queue=stage['queue'])
+    trace_log = open(args.trace_log, 'r', encoding='utf-8') if os.path.isfile(args.trace_log) else None
+    if trace_log is not None:
+        trace_log.seek(0, os.SEEK_END)  # only records of this run are read
+
+    def publish(body: str, headers: dict):
+        channel.basic_publish(exchange='', routing_key=stage['queue'], body=body,
+                              properties=pika.BasicProperties(headers=headers))
+        connection.process_data_events(time_limit=0)
+
+    def poll():
+        nonlocal trace_log
+        connection.process_data_events(time_limit=0)
+        if trace_log is None:
+            if not os.path.isfile(args.trace_log):
+                return
+            trace_log = open(args.trace_log, 'r', encoding='utf-8')
+        for line in trace_log.readlines():
+            try:
+                stats.on_trace_record(json.loads(line), stage['done_event'])
+            except json.JSONDecodeError:
+                continue
+    start_time = time.perf_counter()
+    sender = threading.Thread(target=send_corpus, args=(publish, files, args.rate, stats))
+    sender.start()
+    sender.join()
+    wait_finished(stats, args.timeout, poll=poll)
+    connection.close()
+    return time.perf_counter() - start_time
+
+
+def validate_args(args):
+    if not os.path.isdir(args.corpus):
+        raise Exception(f'corpus directory - {args.corpus} not exists')
+    if len(os.listdir(args.corpus)) == 0:
+        raise Exception(f'corpus directory - {args.corpus} is empty')
+    if args.count <= 0:
+        raise Exception(f'invalid count={args.count}, should be a positive value')
+    if args.rate < 0:
+        raise Exception(f'invalid rate={args.rate}, should be non negative')
+    if args.broker == 'rabbitmq' and not args.trace_log:
+        raise Exception('trace log of the stage is required for rabbitmq broker')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay text corpus into the pipeline stage and report throughput, '
+                                                 'latency percentiles, redeliveries and errors')
+    parser.add_argument('--stage', type=str, required=True, choices=list(STAGES),
+                        help='stage under the load')
+    parser.add_argument('--corpus', type=str, required=True,
+                        help='directory with text files, their paths are sent to the stage')
+    parser.add_argument('--count', type=int, required=False, default=100,
+                        help='count of messages to send (corpus is repeated if necessary)')
+    parser.add_argument('--rate', type=float, required=False, default=0.0,
+                        help='messages per second, 0 - as fast as possible')
+    parser.add_argument('--broker', type=str, required=False, default='memory', choices=['memory', 'rabbitmq'],
+                        help="'memory' - stage runs in this process with in-memory broker, "
+                             "'rabbitmq' - stage is already running and consuming from RabbitMQ")
+    parser.add_argument('--stage_args', type=str, required=False, default='',
+                        help="arguments of the stage for memory broker, e.g. \"--backend stub\" for the formatter "
+                             "without GPU")
+    parser.add_argument('--broker_host', type=str, required=False, default='localhost',
+                        help='hostname of message broker')
+    parser.add_argument('--broker_port', type=int, required=False, default=5672,
+                        help='port where message broker is running')
+    parser.add_argument('--trace_log', type=str, required=False, default='',
+                        help='trace log of the running stage (rabbitmq broker), e.g. formatting/trace/formatter.jsonl')
+    parser.add_argument('--timeout', type=float, required=False, default=3600.0,
+                        help='maximum time to wait for processing of sent messages in seconds')
+    try:
+        args = parser.parse_args()
+        validate_args(args)
+    except Exception as e:
+        print('Parse args exception: ' + repr(e), file=sys.stderr)
+        parser.print_help()
+        return
+    files = get_corpus(args.corpus, args.count)
+    stats = LoadStats(args.stage)
+
+    if args.broker == 'memory':
+        wall_time = run_memory(args, files, stats)
+    else:
+        wall_time = run_rabbitmq(args, files, stats)
+    print('STAT:')
+    print(stats.report(wall_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import datetime
+import decimal
+import itertools
+import queue
+import sys
+import threading
+import types
+from collections import deque
+
+
+# value types which pika can encode in header tables (floats are not supported)
+HEADER_TYPES = (str, bytes, int, bool, decimal.Decimal, datetime.datetime, dict, list, type(None))
+
+
+class ChannelClosedByBroker(Exception):
+    pass
+
+
+class UnsupportedAMQPFieldException(Exception):
+    pass
+
+
+def validate_header_value(value, name: str):
+    # the same restriction as pika.data.encode_value, so stages fail here as they fail on RabbitMQ
+    if not isinstance(value, HEADER_TYPES):
+        raise UnsupportedAMQPFieldException(f'header {name} has unsupported type {type(value).__name__}')
+    if isinstance(value, dict):
+        for key, item in value.items():
+            validate_header_value(item, f'{name}.{key}')
+    elif isinstance(value, list):
+        for idx, item in enumerate(value):
+            validate_header_value(item, f'{name}[{idx}]')
+
+
+class ConnectionParameters:
+    def __init__(self, host: str = 'localhost', port: int = 5672, heartbeat: int = None):
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+
+
+class BasicProperties:
+    def __init__(self, headers: dict = None, delivery_mode: int = None):
+        self.headers = headers
+        self.delivery_mode = delivery_mode
+
+
+class Message:
+    def __init__(self, body: bytes, properties: BasicProperties):
+        self.body = body
+        self.properties = properties if properties is not None else BasicProperties()
+        self.redelivered = False
+
+
+class MemoryBroker:
+    """
+    In-memory stand-in of RabbitMQ with the subset of pika API used by the pipeline stages: default exchange,
+    queues with x-message-ttl and dead-letter routing key (retry queues), prefetch, ack/nack and basic_get.
+    Every published, delivered, acked and dead-lettered message is passed to the listener (see load_test.py).
+    """
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.queues = dict()    # queue name -> deque of messages
+        self.arguments = dict()     # queue name -> declare arguments
+        self.listener = None    # callable (event, queue name, message)
+        self.consumed_queues = set()    # queues with registered consumers
+        self.stopped = False
+
+    def declare(self, queue_name: str, passive: bool = False, arguments: dict = None) -> int:
+        with self.lock:
+            if queue_name not in self.queues:
+                if passive:
+                    raise ChannelClosedByBroker(f"NOT_FOUND - no queue '{queue_name}'")
+                self.queues[queue_name] = deque()
+                self.arguments[queue_name] = arguments or {}
+            return len(self.queues[queue_name])
+
+    def notify(self, event: str, queue_name: str, message: Message):
+        if self.listener is not None:
+            self.listener(event, queue_name, message)
+
+    def publish(self, queue_name: str, message: Message):
+        with self.lock:
+            if queue_name not in self.queues:
+                return  # message to the not declared queue is dropped as by default exchange
+            self.queues[queue_name].append(message)
+            self.lock.notify_all()
+            arguments = self.arguments[queue_name]
+        self.notify('published', queue_name, message)
+        if 'x-message-ttl' in arguments:
+            # message expires and is dead-lettered to the target queue
+            timer = threading.Timer(arguments['x-message-ttl'] / 1000, self.expire,
+                                    args=(queue_name, message, arguments.get('x-dead-letter-routing-key')))
+            timer.daemon = True
+            timer.start()
+
+    def expire(self, queue_name: str, message: Message, target_queue: str):
+        with self.lock:
+            try:
+                self.queues[queue_name].remove(message)
+            except ValueError:
+                return  # already consumed
+        if target_queue is not None:
+            self.publish(target_queue, message)
+
+    def get(self, queue_name: str):
+        with self.lock:
+            messages = self.queues.get(queue_name)
+            return messages.popleft() if messages else None
+
+    def requeue(self, queue_name: str, message: Message):
+        message.redelivered = True
+        with self.lock:
+            self.queues[queue_name].appendleft(message)
+            self.lock.notify_all()
+        self.notify('requeued', queue_name, message)
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+
+
+broker = MemoryBroker()
+
+
+class Method:
+    def __init__(self, delivery_tag: int = None, redelivered: bool = False, message_count: int = 0):
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+        self.message_count = message_count
+
+
+class DeclareResult:
+    def __init__(self, message_count: int):
+        self.method = Method(message_count=message_count)
+
+
+class Channel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.prefetch_count = 0
+        self.consumers = []     # (queue name, callback)
+        self.unacked = dict()   # delivery tag -> (queue name, message)
+        self.tags = itertools.count(1)
+
+    def queue_declare(self, queue: str, passive: bool = False, arguments: dict = None, **kwargs):
+        return DeclareResult(broker.declare(queue, passive, arguments))
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties: BasicProperties = None, **kwargs):
+        if properties is not None and properties.headers is not None:
+            validate_header_value(properties.headers, 'headers')
+        broker.publish(routing_key, Message(body if isinstance(body, bytes) else body.encode(), properties))
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False, **kwargs):
+        self.consumers.append((queue, on_message_callback))
+        broker.consumed_queues.add(queue)
+
+    def basic_get(self, queue: str, auto_ack: bool = False):
+        message = broker.get(queue)
+        if message is None:
+            return None, None, None
+        tag = next(self.tags)
+        if not auto_ack:
+            self.unacked[tag] = (queue, message)
+        return Method(tag, message.redelivered), message.properties, message.body
+
+    def basic_ack(self, delivery_tag: int, **kwargs):
+        queue_name, message = self.unacked.pop(delivery_tag)
+        broker.notify('acked', queue_name, message)
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True, **kwargs):
+        queue_name, message = self.unacked.pop(delivery_tag)
+        if requeue:
+            broker.requeue(queue_name, message)
+        else:
+            broker.notify('rejected', queue_name, message)
+
+    def _deliver(self):
+        for queue_name, callback in self.consumers:
+            while self.prefetch_count == 0 or len(self.unacked) < self.prefetch_count:
+                message = broker.get(queue_name)
+                if message is None:
+                    break
+                tag = next(self.tags)
+                self.unacked[tag] = (queue_name, message)
+                broker.notify('delivered', queue_name, message)
+                callback(self, Method(tag, message.redelivered), message.properties, message.body)
+
+    def start_consuming(self):
+        # runs thread safe callbacks (acks of worker threads) and delivers messages until the broker is stopped
+        while not broker.stopped:
+            self.connection.process_data_events(time_limit=0.01)
+            self._deliver()
+
+    def close(self):
+        for queue_name, message in self.unacked.values():
+            broker.requeue(queue_name, message)
+        self.unacked.clear()
+
+
+class BlockingConnection:
+    def __init__(self, parameters: ConnectionParameters = None):
+        self.callbacks = queue.Queue()
+        self.channels = []
+
+    def channel(self):
+        channel = Channel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def process_data_events(self, time_limit: float = 0):
+        # runs queued thread safe callbacks, waits for the first one up to time_limit
+        try:
+            callback = self.callbacks.get(timeout=time_limit) if time_limit else self.callbacks.get_nowait()
+        except queue.Empty:
+            return
+        callback()
+        while True:
+            try:
+                callback = self.callbacks.get_nowait()
+            except queue.Empty:
+                return
+            callback()
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+
+def install():
+    # replaces pika module, so stage brokers work with the in-memory broker
+    module = types.ModuleType('pika')
+    module.BlockingConnection = BlockingConnection
+    module.ConnectionParameters = ConnectionParameters
+    module.BasicProperties = BasicProperties
+    module.exceptions = types.SimpleNamespace(ChannelClosedByBroker=ChannelClosedByBroker,
+                                              UnsupportedAMQPFieldException=UnsupportedAMQPFieldException)
+    sys.modules['pika'] = module
+    return broker
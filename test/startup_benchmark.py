@@ -0,0 +1,71 @@
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# service -> entry script
+SERVICES = {
+    'crawler': os.path.join('scrapping', 'main.py'),
+    'formatter': os.path.join('formatting', 'qwen_vllm_doc_filter_chat.py'),
+    'chunker': os.path.join('chunking', 'smart_chunking.py'),
+}
+
+
+def parse_import_times(stderr: str):
+    # output of python -X importtime: 'import time: self [us] | cumulative | imported package'
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        if not package.startswith(' ' * 2):     # top level imports only
+            times.append((int(cumulative), package.strip()))
+    return sorted(times, reverse=True)
+
+
+def run_service(script: str, script_args: list, cwd: str):
+    start_time = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(ROOT_DIR, script)] + script_args,
+                            cwd=cwd, capture_output=True, text=True)
+    return time.perf_counter() - start_time, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='startup time of the services cli (e.g. --help or invalid args), '
+                                                 'measured from a foreign working directory')
+    parser.add_argument('--services', nargs='*', default=list(SERVICES), choices=list(SERVICES),
+                        help='services to measure')
+    parser.add_argument('--args', type=str, required=False, default='--help',
+                        help='arguments passed to every service')
+    parser.add_argument('--repeat', type=int, required=False, default=5,
+                        help='count of runs of every service')
+    parser.add_argument('--top', type=int, required=False, default=10,
+                        help='count of the slowest top level imports to show')
+    args = parser.parse_args()
+    if args.repeat <= 0:
+        print(f'Parse args exception: invalid repeat={args.repeat}, should be positive', file=sys.stderr)
+        parser.print_help()
+        return
+
+    with tempfile.TemporaryDirectory() as cwd:
+        for service in args.services:
+            wall_times, result = [], None
+            for _ in range(args.repeat):
+                wall_time, result = run_service(SERVICES[service], shlex.split(args.args), cwd)
+                wall_times.append(wall_time)
+            print(f'{service}: median={median(wall_times):.3f}s; min={min(wall_times):.3f}s; '
+                  f'max={max(wall_times):.3f}s; exit code={result.returncode}')
+            if result.returncode != 0:
+                print(result.stderr.splitlines()[-1] if result.stderr else '', file=sys.stderr)
+            for cumulative, package in parse_import_times(result.stderr)[:args.top]:
+                print(f'    {cumulative / 1e6:.3f}s {package}')
+
+
+if __name__ == '__main__':
+    main()
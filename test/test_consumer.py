@@ -2,6 +2,14 @@ import pika
 import argparse
 import sys
 import json
+import time
+
+
+def parse_bool_str(arg:str):
+    try:
+        return {'true': True, 'false': False}[arg.lower()]
+    except KeyError:
+        raise argparse.ArgumentTypeError(f'invalid bool literal: {arg}')
 
 
 def main():
@@ -12,6 +20,10 @@ def main():
                         help='port where message broker is running')
     parser.add_argument('--queue_name', type=str, required=True,
                         help='queue of corresponding producer channel')
+    parser.add_argument('--trace', type=parse_bool_str, required=False, default=False,
+                        help='save trace headers and receive time of messages (see trace_report.py)')
+    parser.add_argument('--output', type=str, required=False, default='consumed.json',
+                        help='file to save consumed messages')
     args = parser.parse_args()
     queue_name = args.queue_name
     host, port = args.broker_host, args.broker_port
@@ -29,7 +41,10 @@ def main():
                 msg = body.decode()
                 print(f'recieved: {msg}')
                 ch.basic_ack(delivery_tag=method.delivery_tag)
-                result.append(msg)
+                if args.trace:
+                    result.append({'message': msg, 'received': int(time.time() * 1000), 'headers': properties.headers or {}})
+                else:
+                    result.append(msg)
                 totally_consumed += 1
             except Exception as e:
                 totally_errors += 1
@@ -40,8 +55,8 @@ def main():
                               auto_ack=False)
         channel.start_consuming()
     except (KeyboardInterrupt, InterruptedError):
-        json_string = json.dumps(result)
-        with open('consumed.json', 'w', encoding='utf-8') as f:
+        json_string = json.dumps(result, default=str)
+        with open(args.output, 'w', encoding='utf-8') as f:
             f.write(json_string)
         print(f'key interrupted, close the channel', file=sys.stderr)
         print('STAT:')
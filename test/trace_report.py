@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import sys
+from typing import List
+
+
+# (metric, start event, end event): queue wait includes time in consumer prefetch buffer
+METRICS = [
+    ('crawler service', 'fetched', 'published'),
+    ('scrapper_queue wait', 'published', 'formatter.started'),
+    ('formatter service', 'formatter.started', 'formatted'),
+    ('formatter_queue wait', 'formatter.published', 'chunker.started'),
+    ('chunker service', 'chunker.started', 'chunked'),
+    ('test consumer wait', None, 'consumer.received'),     # from the last published event
+    ('end-to-end', 'fetched', None),    # to the last event of the document
+]
+PERCENTILES = [50, 90, 99]
+
+
+def read_trace_logs(log_paths: List[str], traces: dict):
+    for log_path in log_paths:
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                traces.setdefault(record['trace_id'], dict()).update(record['events'])
+
+
+def read_consumed(consumed_path: str, traces: dict):
+    # messages saved by test_consumer.py with --trace=true
+    with open(consumed_path, 'r', encoding='utf-8') as f:
+        consumed = json.loads(f.read())
+    for item in consumed:
+        if not isinstance(item, dict) or 'x-trace-id' not in item['headers']:
+            continue
+        events = traces.setdefault(item['headers']['x-trace-id'], dict())
+        events.update(item['headers'].get('x-trace') or {})
+        events['consumer.received'] = item['received']
+
+
+def metric_values(traces: dict, start_event: str, end_event: str) -> List[float]:
+    values = []
+
+    for events in traces.values():
+        events = {event: int(ts) / 1000 for event, ts in events.items()}  # ms timestamps to seconds
+        start = events.get(start_event) if start_event is not None else \
+            max((ts for event, ts in events.items() if event.endswith('published')), default=None)
+        end = events.get(end_event) if end_event is not None else max(events.values(), default=None)
+        if start is not None and end is not None:
+            values.append(end - start)
+    return values
+
+
+def percentile(sorted_values: List[float], p: int) -> float:
+    idx = min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[idx]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='per-stage queue wait and service time percentiles of traced '
+                                                 'documents, built from stages trace logs and test_consumer output')
+    parser.add_argument('--trace_logs', nargs='*', default=[],
+                        help='trace logs of the stages (e.g. scrapping/trace/crawler.jsonl)')
+    parser.add_argument('--consumed', type=str, required=False, default='',
+                        help='output of test_consumer.py --trace=true')
+    try:
+        args = parser.parse_args()
+        for path in args.trace_logs + ([args.consumed] if args.consumed else []):
+            if not os.path.isfile(path):
+                raise Exception(f'file - {path} not exists')
+        if len(args.trace_logs) == 0 and not args.consumed:
+            raise Exception('no trace logs or consumed file are specified')
+    except Exception as e:
+        print('Parse args exception: ' + repr(e), file=sys.stderr)
+        parser.print_help()
+        return
+    traces = dict()
+    read_trace_logs(args.trace_logs, traces)
+    if args.consumed:
+        read_consumed(args.consumed, traces)
+    print(f'traced documents={len(traces)}')
+
+    for name, start_event, end_event in METRICS:
+        values = sorted(metric_values(traces, start_event, end_event))
+        if len(values) == 0:
+            continue
+        percentiles = '; '.join(f'p{p}={percentile(values, p):.3f}s' for p in PERCENTILES)
+        print(f'{name}: count={len(values)}; mean={sum(values) / len(values):.3f}s; {percentiles}; '
+              f'max={values[-1]:.3f}s')
+
+
+if __name__ == '__main__':
+    main()